@@ -0,0 +1,299 @@
+"""
+Benchmark suite for operations, external sort and graphs.
+
+Run from the directory containing the package:
+    python -m compgraph.benchmark --scales 3 4 5 --output baseline.json
+    python -m compgraph.benchmark --scales 3 4 5 --baseline baseline.json
+
+Every benchmark is measured on synthetic data at scales 10 ** scale rows and reports throughput, peak RSS
+of the main process and scaling exponent between consecutive scales (1.0 means linear scaling).
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import typing as tp
+
+from time import perf_counter
+
+from . import graphs
+from .lib import Graph, operations as ops
+from .lib.external_sort import ExternalSort
+from .lib.memory_watchdog import MemoryWatchdog
+
+TRowsFactory = tp.Callable[[int], ops.TRowsIterable]
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliett",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango"]
+PUNCTUATION = ["", "", "", ",", ".", "!", "?"]
+WORDS_PER_DOC = 10
+EDGES_AMOUNT = 1000
+SEED = 0
+MEMORY_LIMIT = 1024 ** 4  # watchdog is used only to measure peak memory
+DEFAULT_TOLERANCE = 0.2
+
+
+# Synthetic data
+
+
+def generate_rows(n: int) -> ops.TRowsGenerator:
+    """
+    Generate rows with typical column types
+    :param n: number of rows
+    """
+    rnd = random.Random(SEED)
+    for i in range(n):
+        yield {"id": i, "key": rnd.randrange(max(n // 10, 1)), "value": rnd.random() * 100,
+               "text": rnd.choice(WORDS) + rnd.choice(PUNCTUATION) + " " + rnd.choice(WORDS).upper()}
+
+
+def generate_sorted_rows(n: int, group_size: int = 10) -> ops.TRowsGenerator:
+    """
+    Generate rows sorted by 'key' column
+    :param n: number of rows
+    :param group_size: number of rows with same key
+    """
+    rnd = random.Random(SEED)
+    for i in range(n):
+        yield {"key": i // group_size, "value": rnd.random() * 100, "text": rnd.choice(WORDS)}
+
+
+def generate_docs(n: int) -> ops.TRowsGenerator:
+    """
+    Generate documents for text graphs
+    :param n: number of documents
+    """
+    rnd = random.Random(SEED)
+    for doc_id in range(n):
+        words = (rnd.choice(WORDS) + rnd.choice(PUNCTUATION) for _ in range(WORDS_PER_DOC))
+        yield {"doc_id": doc_id, "text": " ".join(words)}
+
+
+def generate_edges(n: int) -> ops.TRowsGenerator:
+    """
+    Generate road graph edges
+    :param n: number of edges
+    """
+    rnd = random.Random(SEED)
+    for edge_id in range(n):
+        start = [37.5 + rnd.random() * 0.5, 55.5 + rnd.random() * 0.5]
+        end = [start[0] + rnd.random() * 0.01, start[1] + rnd.random() * 0.01]
+        yield {"edge_id": edge_id, "start": start, "end": end}
+
+
+def generate_travel_times(n: int) -> ops.TRowsGenerator:
+    """
+    Generate travel times over edges from generate_edges
+    :param n: number of records
+    """
+    rnd = random.Random(SEED)
+    for _ in range(n):
+        day = rnd.randrange(1, 29)
+        hour = rnd.randrange(24)
+        minute = rnd.randrange(59)
+        enter_time = "201710{:02d}T{:02d}{:02d}00.000000".format(day, hour, minute)
+        leave_time = "201710{:02d}T{:02d}{:02d}{:02d}.500000".format(day, hour, minute + 1, rnd.randrange(60))
+        yield {"edge_id": rnd.randrange(EDGES_AMOUNT), "enter_time": enter_time, "leave_time": leave_time}
+
+
+# Benchmarks
+
+
+class Benchmark:
+    """Single benchmark case: callable consuming 10 ** scale input rows"""
+
+    def __init__(self, name: str, run: tp.Callable[[int], tp.Iterable[tp.Any]]) -> None:
+        """
+        :param name: benchmark name
+        :param run: function creating result iterable for given number of input rows
+        """
+        self.name = name
+        self.run = run
+
+    def measure(self, n: int) -> tp.Dict[str, tp.Any]:
+        """
+        Run benchmark on n input rows and collect statistics
+        :param n: number of input rows
+        """
+        watchdog = MemoryWatchdog(MEMORY_LIMIT)
+        watchdog.start()
+        start = perf_counter()
+        output_rows = 0
+        for _ in self.run(n):
+            output_rows += 1
+        seconds = perf_counter() - start
+        watchdog.stop()
+        watchdog.join()
+
+        return {"name": self.name, "rows": n, "output_rows": output_rows, "seconds": seconds,
+                "rows_per_second": n / seconds if seconds > 0 else math.inf,
+                "peak_rss": watchdog.maximum_memory_usage}
+
+
+def map_benchmark(name: str, mapper: ops.Mapper, rows_factory: TRowsFactory = generate_rows) -> Benchmark:
+    return Benchmark("map/" + name, lambda n: ops.Map(mapper)(rows_factory(n)))
+
+
+def reduce_benchmark(name: str, reducer: ops.Reducer, keys: tp.Sequence[str]) -> Benchmark:
+    return Benchmark("reduce/" + name, lambda n: ops.Reduce(reducer, keys)(generate_sorted_rows(n)))
+
+
+def join_benchmark(name: str, joiner: ops.Joiner) -> Benchmark:
+    def run(n: int) -> ops.TRowsIterable:
+        left = generate_sorted_rows(n // 2, group_size=2)
+        right = ({"key": row["key"] * 2, "weight": row["value"]}
+                 for row in generate_sorted_rows(n // 2, group_size=1))
+        return ops.Join(joiner, ["key"])(left, right)
+
+    return Benchmark("join/" + name, run)
+
+
+def graph_benchmarks() -> tp.List[Benchmark]:
+    word_count = graphs.word_count_graph("docs")
+    inverted_index = graphs.inverted_index_graph("docs")
+    pmi = graphs.pmi_graph("docs")
+    yandex_maps = graphs.yandex_maps_graph("travel_time", "edge_length")
+
+    def text_graph_run(graph: Graph) -> tp.Callable[[int], tp.Iterable[tp.Any]]:
+        # every document produces WORDS_PER_DOC rows, so scale is applied to the amount of words
+        return lambda n: graph.run(docs=lambda: generate_docs(max(n // WORDS_PER_DOC, 1)), return_lst=False)
+
+    return [
+        Benchmark("graph/word_count", text_graph_run(word_count)),
+        Benchmark("graph/inverted_index", text_graph_run(inverted_index)),
+        Benchmark("graph/pmi", text_graph_run(pmi)),
+        Benchmark("graph/yandex_maps", lambda n: yandex_maps.run(travel_time=lambda: generate_travel_times(n),
+                                                                 edge_length=lambda: generate_edges(EDGES_AMOUNT),
+                                                                 return_lst=False)),
+    ]
+
+
+def all_benchmarks() -> tp.List[Benchmark]:
+    """Construct list of all benchmarks"""
+    return [
+        map_benchmark("dummy", ops.DummyMapper()),
+        map_benchmark("filter_punctuation", ops.FilterPunctuation("text")),
+        map_benchmark("lower_case", ops.LowerCase("text")),
+        map_benchmark("split", ops.Split("text")),
+        map_benchmark("product", ops.Product(["value", "key"], "product")),
+        map_benchmark("filter", ops.Filter(lambda row: row["value"] > 50)),
+        map_benchmark("project", ops.Project(["id", "value"])),
+        map_benchmark("inverse_frequency", ops.InverseFrequency("value", "id", "idf"),
+                      lambda n: ({"id": row["id"] + 1, "value": row["value"] + 1} for row in generate_rows(n))),
+        map_benchmark("calculate_distance", ops.CalculateDistance("start", "end", "length"), generate_edges),
+        map_benchmark("weekday", ops.WeekDay("enter_time", "weekday"), generate_travel_times),
+        map_benchmark("hour", ops.Hour("enter_time", "hour"), generate_travel_times),
+        map_benchmark("time_delta", ops.TimeDelta("enter_time", "leave_time", "time"), generate_travel_times),
+        map_benchmark("speed", ops.Speed("value", "id", "speed"),
+                      lambda n: ({"id": row["id"] + 1, "value": row["value"]} for row in generate_rows(n))),
+        reduce_benchmark("first", ops.FirstReducer(), ["key"]),
+        reduce_benchmark("top_n", ops.TopN("value", 3), ["key"]),
+        reduce_benchmark("term_frequency", ops.TermFrequency("text"), ["key"]),
+        reduce_benchmark("count", ops.Count("count"), ["key"]),
+        reduce_benchmark("sum", ops.Sum("value"), ["key"]),
+        reduce_benchmark("mean", ops.Mean("value"), ["key"]),
+        join_benchmark("inner", ops.InnerJoiner()),
+        join_benchmark("outer", ops.OuterJoiner()),
+        join_benchmark("left", ops.LeftJoiner()),
+        join_benchmark("right", ops.RightJoiner()),
+        Benchmark("external_sort", lambda n: ExternalSort(["key", "id"])(generate_rows(n))),
+    ] + graph_benchmarks()
+
+
+# Reporting
+
+
+def scaling_exponent(first: tp.Dict[str, tp.Any], second: tp.Dict[str, tp.Any]) -> float:
+    """
+    Estimate exponent k in time ~ rows ** k between two measurements
+    """
+    if first["seconds"] <= 0 or second["seconds"] <= 0:
+        return math.nan
+    return math.log(second["seconds"] / first["seconds"]) / math.log(second["rows"] / first["rows"])
+
+
+def print_report(results: tp.List[tp.Dict[str, tp.Any]]) -> None:
+    print("{:<32}{:>12}{:>14}{:>12}{:>10}".format("benchmark", "rows", "rows/s", "peak MiB", "scaling"))
+    previous: tp.Optional[tp.Dict[str, tp.Any]] = None
+    for result in results:
+        exponent = ""
+        if previous is not None and previous["name"] == result["name"]:
+            exponent = "{:.2f}".format(scaling_exponent(previous, result))
+        print("{:<32}{:>12}{:>14.0f}{:>12.1f}{:>10}".format(result["name"], result["rows"], result["rows_per_second"],
+                                                          result["peak_rss"] / 1024 ** 2, exponent))
+        previous = result
+
+
+def find_regressions(results: tp.List[tp.Dict[str, tp.Any]], baseline: tp.List[tp.Dict[str, tp.Any]],
+                     tolerance: float) -> tp.List[str]:
+    """
+    Compare results with baseline ones
+    :param results: current measurements
+    :param baseline: stored measurements
+    :param tolerance: allowed relative slowdown or memory growth
+    :return: descriptions of regressions
+    """
+    baseline_by_case = {(result["name"], result["rows"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_by_case.get((result["name"], result["rows"]))
+        if base is None:
+            continue
+        if result["rows_per_second"] < base["rows_per_second"] * (1 - tolerance):
+            regressions.append("{} at {} rows: {:.0f} rows/s, baseline {:.0f} rows/s".format(
+                result["name"], result["rows"], result["rows_per_second"], base["rows_per_second"]))
+        if result["peak_rss"] > base["peak_rss"] * (1 + tolerance):
+            regressions.append("{} at {} rows: peak RSS {} bytes, baseline {} bytes".format(
+                result["name"], result["rows"], result["peak_rss"], base["peak_rss"]))
+    return regressions
+
+
+def run_benchmarks(scales: tp.Sequence[int], name_filter: str = "") -> tp.List[tp.Dict[str, tp.Any]]:
+    """
+    Run benchmarks
+    :param scales: decimal logarithms of input sizes
+    :param name_filter: run only benchmarks with names containing this substring
+    """
+    results = []
+    for benchmark in all_benchmarks():
+        if name_filter not in benchmark.name:
+            continue
+        for scale in sorted(scales):
+            results.append(benchmark.measure(10 ** scale))
+    return results
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[3, 4, 5],
+                        help="decimal logarithms of input sizes, from 3 to 7")
+    parser.add_argument("--filter", default="", help="run only benchmarks with names containing this substring")
+    parser.add_argument("--output", help="file to save results in JSON format")
+    parser.add_argument("--baseline", help="file with saved results to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown or memory growth compared to baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.filter)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
@@ -4,46 +4,62 @@ import typing as tp
 
 def word_count_graph(input_stream_name: str, text_column: str = 'text', count_column: str = 'count') -> Graph:
     """Constructs graph which counts words in text_column of all rows passed"""
+    # words are sorted and counted as integer ids, decoded before sorting by words
+    dictionary = operations.StringDictionary()
     return Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
+        .map(operations.Tokenize(text_column, keep_columns=[], count_column=count_column)) \
+        .map(operations.EncodeStrings(text_column, dictionary)) \
         .sort([text_column]) \
-        .reduce(operations.Count(count_column), [text_column]) \
+        .reduce(operations.Sum(count_column), [text_column]) \
+        .map(operations.DecodeStrings(text_column, dictionary)) \
         .sort([count_column, text_column])
 
 
 def word_count_graph_from_file(input_stream_name: str, parser: tp.Callable[[str], operations.TRow],
                                text_column: str = 'text', count_column: str = 'count') -> Graph:
     """Constructs graph which counts words in text_column of all rows passed"""
+    # words are sorted and counted as integer ids, decoded before sorting by words
+    dictionary = operations.StringDictionary()
     return Graph.graph_from_file(input_stream_name, parser) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
+        .map(operations.Tokenize(text_column, keep_columns=[], count_column=count_column)) \
+        .map(operations.EncodeStrings(text_column, dictionary)) \
         .sort([text_column]) \
-        .reduce(operations.Count(count_column), [text_column]) \
+        .reduce(operations.Sum(count_column), [text_column]) \
+        .map(operations.DecodeStrings(text_column, dictionary)) \
         .sort([count_column, text_column])
 
 
 def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: str = 'text',
-                         result_column: str = 'tf_idf') -> Graph:
-    """Constructs graph which calculates td-idf for every word/document pair"""
+                         result_column: str = 'tf_idf', approximate: bool = False) -> Graph:
+    """
+    Constructs graph which calculates td-idf for every word/document pair
+    :param approximate: count documents and documents of every word with HyperLogLog sketches instead of exact
+        deduplication, which saves a sort; error of counts is about 1%, small counts are exact
+    """
+    # words are sorted and joined as integer ids, decoded before the final sort
+    dictionary = operations.StringDictionary()
     graph1 = Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column))
+        .map(operations.Tokenize(text_column, keep_columns=[doc_column])) \
+        .map(operations.EncodeStrings(text_column, dictionary))
 
     count_column = "docs_amount"
-    graph2 = Graph.graph_from_iter(input_stream_name) \
-        .sort([doc_column]) \
-        .reduce(operations.Count(count_column), [])
-
     suffix_enc = ""
     suffix_all = "_overall"
-    idf_graph = graph1.sort([doc_column, text_column]) \
-        .reduce(operations.FirstReducer(), [doc_column, text_column]) \
-        .sort([text_column]) \
-        .reduce(operations.Count(count_column), [text_column]) \
+    if approximate:
+        graph2 = Graph.graph_from_iter(input_stream_name) \
+            .reduce(operations.ApproximateCountDistinct(doc_column, count_column), [])
+        docs_graph = graph1.sort([text_column]) \
+            .reduce(operations.ApproximateCountDistinct(doc_column, count_column), [text_column])
+    else:
+        graph2 = Graph.graph_from_iter(input_stream_name) \
+            .sort([doc_column]) \
+            .reduce(operations.Count(count_column), [])
+        # every input row is a document, so words of document are consecutive
+        docs_graph = graph1.distinct([doc_column, text_column], grouped_by=[doc_column]) \
+            .sort([text_column]) \
+            .reduce(operations.Count(count_column), [text_column])
+
+    idf_graph = docs_graph \
         .join(operations.InnerJoiner(suffix_enc, suffix_all), graph2, []) \
         .map(operations.InverseFrequency(count_column + suffix_all, count_column + suffix_enc))
 
@@ -55,7 +71,8 @@ def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', tex
         .join(operations.InnerJoiner(), idf_graph, [text_column]) \
         .map(operations.Product([tf_col, idf_col], result_column)) \
         .reduce(operations.TopN(result_column, 3), [text_column]) \
-        .sort([doc_column]) \
+        .map(operations.DecodeStrings(text_column, dictionary)) \
+        .sort([doc_column, text_column]) \
         .map(operations.Project([doc_column, text_column, result_column]))
 
     return result_graph
@@ -63,24 +80,36 @@ def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', tex
 
 def inverted_index_graph_from_file(input_stream_name: str, parser: tp.Callable[[str], operations.TRow],
                                    doc_column: str = 'doc_id', text_column: str = 'text',
-                                   result_column: str = 'tf_idf') -> Graph:
-    """Constructs graph which calculates td-idf for every word/document pair"""
+                                   result_column: str = 'tf_idf', approximate: bool = False) -> Graph:
+    """
+    Constructs graph which calculates td-idf for every word/document pair
+    :param approximate: count documents and documents of every word with HyperLogLog sketches instead of exact
+        deduplication, which saves a sort; error of counts is about 1%, small counts are exact
+    """
+    # words are sorted and joined as integer ids, decoded before the final sort
+    dictionary = operations.StringDictionary()
     graph1 = Graph.graph_from_file(input_stream_name, parser) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column))
+        .map(operations.Tokenize(text_column, keep_columns=[doc_column])) \
+        .map(operations.EncodeStrings(text_column, dictionary))
 
     count_column = "docs_amount"
-    graph2 = Graph.graph_from_file(input_stream_name, parser) \
-        .sort([doc_column]) \
-        .reduce(operations.Count(count_column), [])
-
     suffix_enc = ""
     suffix_all = "_overall"
-    idf_graph = graph1.sort([doc_column, text_column]) \
-        .reduce(operations.FirstReducer(), [doc_column, text_column]) \
-        .sort([text_column]) \
-        .reduce(operations.Count(count_column), [text_column]) \
+    if approximate:
+        graph2 = Graph.graph_from_file(input_stream_name, parser) \
+            .reduce(operations.ApproximateCountDistinct(doc_column, count_column), [])
+        docs_graph = graph1.sort([text_column]) \
+            .reduce(operations.ApproximateCountDistinct(doc_column, count_column), [text_column])
+    else:
+        graph2 = Graph.graph_from_file(input_stream_name, parser) \
+            .sort([doc_column]) \
+            .reduce(operations.Count(count_column), [])
+        # every input row is a document, so words of document are consecutive
+        docs_graph = graph1.distinct([doc_column, text_column], grouped_by=[doc_column]) \
+            .sort([text_column]) \
+            .reduce(operations.Count(count_column), [text_column])
+
+    idf_graph = docs_graph \
         .join(operations.InnerJoiner(suffix_enc, suffix_all), graph2, []) \
         .map(operations.InverseFrequency(count_column + suffix_all, count_column + suffix_enc))
 
@@ -92,7 +121,8 @@ def inverted_index_graph_from_file(input_stream_name: str, parser: tp.Callable[[
         .join(operations.InnerJoiner(), idf_graph, [text_column]) \
         .map(operations.Product([tf_col, idf_col], result_column)) \
         .reduce(operations.TopN(result_column, 3), [text_column]) \
-        .sort([doc_column]) \
+        .map(operations.DecodeStrings(text_column, dictionary)) \
+        .sort([doc_column, text_column]) \
         .map(operations.Project([doc_column, text_column, result_column]))
 
     return result_graph
@@ -107,15 +137,14 @@ def pmi_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: s
         return len(row[text_column]) > 4 and row[count_column] > 1
 
     graph1 = Graph.graph_from_iter(input_stream_name) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
+        .map(operations.Tokenize(text_column, keep_columns=[doc_column])) \
         .sort([doc_column, text_column])
 
     filter_graph = graph1.reduce(operations.Count(count_column), [doc_column, text_column]) \
-        .map(operations.Filter(words_filter))
+        .map(operations.Filter(words_filter, [text_column, count_column]))
 
-    filtered_graph = graph1.join(operations.InnerJoiner(), filter_graph, [doc_column, text_column])
+    # most words are filtered out, so rows of graph1 without match are dropped before the sort by Bloom filter
+    filtered_graph = graph1.join(operations.InnerJoiner(), filter_graph, [doc_column, text_column], bloom_filter=True)
 
     frequency_column = "words_frequency"
     graph2 = filtered_graph.reduce(operations.TermFrequency(text_column, frequency_column), []) \
@@ -129,8 +158,7 @@ def pmi_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: s
         .sort([text_column]) \
         .join(operations.InnerJoiner(suffix_enc, suffix_all), graph2, [text_column]) \
         .map(operations.InverseFrequency(frequency_column + suffix_enc, frequency_column + suffix_all, result_column)) \
-        .sort([doc_column, result_column]) \
-        .reduce(operations.TopN(result_column, 10, ascending=True), [doc_column]) \
+        .sort_top_n([doc_column], result_column, 10, ascending=True) \
         .map(operations.Project([doc_column, text_column, result_column]))
 
     return graph3
@@ -146,16 +174,15 @@ def pmi_graph_from_file(input_stream_name: str, parser: tp.Callable[[str], opera
         return len(row[text_column]) > 4 and row[count_column] > 1
 
     graph1 = Graph.graph_from_file(input_stream_name, parser) \
-        .map(operations.FilterPunctuation(text_column)) \
-        .map(operations.LowerCase(text_column)) \
-        .map(operations.Split(text_column)) \
+        .map(operations.Tokenize(text_column, keep_columns=[doc_column])) \
         .sort([doc_column, text_column])
 
     filter_graph = graph1 \
         .reduce(operations.Count(count_column), [doc_column, text_column]) \
-        .map(operations.Filter(words_filter))
+        .map(operations.Filter(words_filter, [text_column, count_column]))
 
-    filtered_graph = graph1.join(operations.InnerJoiner(), filter_graph, [doc_column, text_column])
+    # most words are filtered out, so rows of graph1 without match are dropped before the sort by Bloom filter
+    filtered_graph = graph1.join(operations.InnerJoiner(), filter_graph, [doc_column, text_column], bloom_filter=True)
 
     frequency_column = "words_frequency"
     graph2 = filtered_graph.reduce(operations.TermFrequency(text_column, frequency_column), []) \
@@ -169,8 +196,7 @@ def pmi_graph_from_file(input_stream_name: str, parser: tp.Callable[[str], opera
         .sort([text_column]) \
         .join(operations.InnerJoiner(suffix_enc, suffix_all), graph2, [text_column]) \
         .map(operations.InverseFrequency(frequency_column + suffix_enc, frequency_column + suffix_all, result_column)) \
-        .sort([doc_column, result_column]) \
-        .reduce(operations.TopN(result_column, 10, ascending=True), [doc_column]) \
+        .sort_top_n([doc_column], result_column, 10, ascending=True) \
         .map(operations.Project([doc_column, text_column, result_column]))
 
     return graph3
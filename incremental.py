@@ -0,0 +1,121 @@
+import math
+import sqlite3
+import typing as tp
+
+from .lib import operations
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (doc_id PRIMARY KEY, length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS doc_terms (doc_id NOT NULL, word TEXT NOT NULL, count INTEGER NOT NULL,
+                                      PRIMARY KEY (doc_id, word));
+CREATE INDEX IF NOT EXISTS doc_terms_by_word ON doc_terms (word);
+CREATE TABLE IF NOT EXISTS words (word TEXT PRIMARY KEY, count INTEGER NOT NULL, docs INTEGER NOT NULL);
+"""
+
+
+class IncrementalTextIndex:
+    """
+    Word statistics of documents corpus (word counts, per-word document frequency and per-document term
+    frequency) kept in on-disk sqlite store. Updates are applied by deltas of added and removed documents,
+    so their cost is proportional to the change, not to the corpus. Results match word_count_graph and
+    inverted_index_graph run on the whole corpus.
+    """
+
+    def __init__(self, path: str, doc_column: str = 'doc_id', text_column: str = 'text') -> None:
+        """
+        :param path: sqlite database file, created if absent
+        :param doc_column: name of column with document id in added documents
+        :param text_column: name of column with text in added documents
+        """
+        self.doc_column = doc_column
+        self.text_column = text_column
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.tokenizer = operations.Tokenize(text_column, keep_columns=[], count_column='count')
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _tokenize(self, doc: operations.TRow) -> tp.Dict[str, int]:
+        return {row[self.text_column]: row['count'] for row in self.tokenizer(doc)}
+
+    def _change_word(self, word: str, count: int, docs: int) -> None:
+        self.connection.execute("INSERT INTO words VALUES (?, 0, 0) ON CONFLICT (word) DO NOTHING", (word,))
+        self.connection.execute("UPDATE words SET count = count + ?, docs = docs + ? WHERE word = ?",
+                                (count, docs, word))
+
+    def _remove_doc(self, doc_id: tp.Any, affected_words: tp.Set[str]) -> None:
+        terms = self.connection.execute("SELECT word, count FROM doc_terms WHERE doc_id = ?", (doc_id,)).fetchall()
+        for word, count in terms:
+            self._change_word(word, -count, -1)
+            affected_words.add(word)
+        self.connection.execute("DELETE FROM doc_terms WHERE doc_id = ?", (doc_id,))
+        self.connection.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+
+    def update(self, added_docs: operations.TRowsIterable = (),
+               removed_doc_ids: tp.Iterable[tp.Any] = ()) -> tp.Set[str]:
+        """
+        Apply delta of documents; added document with already known id replaces the old one
+        :param added_docs: new documents
+        :param removed_doc_ids: ids of removed documents
+        :return: words whose statistics changed
+        """
+        affected_words: tp.Set[str] = set()
+        with self.connection:
+            for doc_id in removed_doc_ids:
+                self._remove_doc(doc_id, affected_words)
+
+            for doc in added_docs:
+                doc_id = doc[self.doc_column]
+                self._remove_doc(doc_id, affected_words)
+                word_counts = self._tokenize(doc)
+                self.connection.execute("INSERT INTO docs VALUES (?, ?)", (doc_id, sum(word_counts.values())))
+                self.connection.executemany("INSERT INTO doc_terms VALUES (?, ?, ?)",
+                                            [(doc_id, word, count) for word, count in word_counts.items()])
+                for word, count in word_counts.items():
+                    self._change_word(word, count, 1)
+                    affected_words.add(word)
+
+            self.connection.execute("DELETE FROM words WHERE docs <= 0")
+        return affected_words
+
+    def _words(self, words: tp.Optional[tp.Iterable[str]]) -> tp.List[tp.Tuple[tp.Any, ...]]:
+        if words is None:
+            return self.connection.execute("SELECT word, count, docs FROM words").fetchall()
+        result = []
+        for word in words:
+            result.extend(self.connection.execute("SELECT word, count, docs FROM words WHERE word = ?", (word,)))
+        return result
+
+    def word_count(self, words: tp.Optional[tp.Iterable[str]] = None,
+                   count_column: str = 'count') -> tp.List[operations.TRow]:
+        """
+        Rows of word_count_graph result
+        :param words: if passed, only rows of these words (e.g. returned by update) are computed
+        :param count_column: name of column with counts
+        """
+        rows = [{self.text_column: word, count_column: count} for word, count, _ in self._words(words)]
+        rows.sort(key=lambda row: (row[count_column], row[self.text_column]))
+        return rows
+
+    def inverted_index(self, words: tp.Optional[tp.Iterable[str]] = None, result_column: str = 'tf_idf',
+                       top_n: int = 3) -> tp.List[operations.TRow]:
+        """
+        Rows of inverted_index_graph result. Amount of documents changes idf of every word, but not the top
+        documents of unaffected words, so re-emitting rows of affected words keeps the set of rows up to date
+        :param words: if passed, only rows of these words (e.g. returned by update) are computed
+        :param result_column: name of column with tf-idf
+        :param top_n: amount of documents with largest tf-idf for every word
+        """
+        docs_amount = self.connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        rows = []
+        for word, _, docs in self._words(words):
+            idf = math.log(docs_amount / docs)
+            top_docs = self.connection.execute(
+                "SELECT doc_terms.doc_id, CAST(count AS REAL) / length * ? AS tf_idf FROM doc_terms "
+                "JOIN docs ON docs.doc_id = doc_terms.doc_id WHERE word = ? "
+                "ORDER BY tf_idf DESC, doc_terms.doc_id LIMIT ?", (idf, word, top_n))
+            for doc_id, tf_idf in top_docs:
+                rows.append({self.doc_column: doc_id, self.text_column: word, result_column: tf_idf})
+        rows.sort(key=lambda row: (row[self.doc_column], row[self.text_column]))
+        return rows
@@ -1,22 +1,165 @@
+import tempfile
 import typing as tp
 
+from heapq import heappush, heappushpop, merge, nsmallest
+from itertools import chain
 from multiprocessing import Pipe, Process, connection
-from operator import itemgetter
+from multiprocessing.synchronize import Event
 
 from . import operations as ops
+from .groups import key_getter
+from .memory_budget import MemoryBudget, read_spill, row_size, write_spill
+from .ring_buffer import RingBuffer
+from .serialization import decode_batch, encode_batch
+from .sinks import batches
+from .sort_keys import comparable_key, encoded_key_getter, sort_key_getter
 
+MIN_SPILLED_BYTES = 64 * 1024  # smaller buffers are not spilled on memory pressure
+PIPE_BATCH_SIZE = 1024  # amount of rows serialized together to be sent to worker or back
 
-def do_sort(endpoint: connection.Connection, keys: tp.Tuple[str, ...]) -> None:
-    rows = []
+TRings = tp.Tuple[RingBuffer, RingBuffer]  # to worker and back
+
+
+def send_rows(endpoint: connection.Connection, rows: ops.TRowsIterable, ring: tp.Optional[RingBuffer] = None) -> int:
+    """
+    Send rows through pipe by serialized batches, followed by empty message marking the end
+    :param ring: if passed, batches are passed through it, and only control messages through pipe
+    :return: amount of rows sent
+    """
+    rows_amount = 0
+    for batch in batches(rows, PIPE_BATCH_SIZE):
+        if ring is None:
+            endpoint.send_bytes(encode_batch(batch))
+        else:
+            ring.send(endpoint, encode_batch(batch))
+        rows_amount += len(batch)
+    endpoint.send_bytes(b"")
+    return rows_amount
+
+
+def received_batches(endpoint: connection.Connection,
+                     ring: tp.Optional[RingBuffer] = None) -> tp.Generator[tp.List[ops.TRow], None, None]:
+    """Receive batches of rows sent with send_rows"""
     while True:
-        row = endpoint.recv()
-        if row is None:
-            break
-        rows.append(row)
-    rows.sort(key=itemgetter(*keys))
-    for row in rows:
-        endpoint.send(row)
-    endpoint.send(None)
+        data = endpoint.recv_bytes() if ring is None else ring.recv(endpoint)
+        if not data:
+            return
+        yield decode_batch(data)
+
+
+def do_sort(endpoint: connection.Connection, keys: tp.Tuple[str, ...], memory_limit: tp.Optional[int] = None,
+            pressure_event: tp.Optional[Event] = None, rings: tp.Optional[TRings] = None) -> None:
+    """
+    Sort rows received from endpoint and send them back. If memory limit is passed, sorted runs are spilled
+    to temporary files when buffer exceeds it (or earlier, when pressure event is set) and merged afterwards.
+    :param rings: if passed, rows are received through the first ring and sent back through the second one
+    """
+    to_worker, from_worker = rings or (None, None)
+    get_key = sort_key_getter(keys)
+
+    def sort(rows: tp.List[ops.TRow]) -> tp.List[ops.TRow]:
+        nonlocal get_key
+        try:
+            # failed list.sort leaves list shuffled, while sorted does not change it, so stability is kept
+            return sorted(rows, key=get_key)
+        except TypeError:
+            # values of different types are not comparable in Python, but their encodings are
+            get_key = encoded_key_getter(keys)
+            return sorted(rows, key=get_key)
+
+    runs: tp.List[tp.IO[bytes]] = []
+    rows: tp.List[ops.TRow] = []
+    buffer_size = 0
+    for batch in received_batches(endpoint, to_worker):
+        rows.extend(batch)
+
+        if memory_limit is None:
+            continue
+        # rows of batch are usually alike, so the first one is a good sample
+        buffer_size += row_size(batch[0]) * len(batch)
+        if buffer_size > memory_limit or \
+                (pressure_event is not None and pressure_event.is_set() and buffer_size > MIN_SPILLED_BYTES):
+            rows = sort(rows)
+            runs.append(tempfile.TemporaryFile())
+            write_spill(rows, runs[-1])
+            rows = []
+            buffer_size = 0
+
+    rows = sort(rows)
+    sorted_rows: ops.TRowsIterable = rows
+    if runs:
+        runs.append(tempfile.TemporaryFile())
+        write_spill(rows, runs[-1])
+        rows = []
+        # merge is stable: equal rows are taken from earlier runs first. Runs are merged by encoded keys, which
+        # order values of the same type as Python does, and values of different types from different runs as well
+        sorted_rows = merge(*(read_spill(run) for run in runs), key=encoded_key_getter(keys))
+
+    send_rows(endpoint, sorted_rows, from_worker)
+
+
+class _Reversed:
+    """Wrapper inverting order of values, used to keep n smallest values in min-heap"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: tp.Any) -> None:
+        self.value = value
+
+    def __lt__(self, other: '_Reversed') -> bool:
+        return bool(other.value < self.value)
+
+
+def select_top_n(rows: ops.TRowsIterable, keys: tp.Sequence[str], column: str, n: int,
+                 ascending: bool = True) -> ops.TRowsGenerator:
+    """
+    Yield groups by keys in sorted order, leaving only top n rows by column value in every group.
+    Result is the same as of sorting by keys and column and applying TopN reducer, but only bounded heap
+    of rows is stored for every group.
+    :param rows: table rows
+    :param keys: keys to unite rows in groups
+    :param column: column name to get top by
+    :param n: number of top rows in every group
+    :param ascending: same as in TopN: True for largest values, False for smallest ones
+    """
+    get_key = key_getter(keys)
+    heaps: tp.Dict[tp.Any, tp.List[tp.Tuple[tp.Any, ...]]] = {}
+    if n <= 0:
+        return
+
+    for index, row in enumerate(rows):
+        # among equal values the first row wins, as heap always pops the least valuable entry
+        if ascending:
+            entry: tp.Tuple[tp.Any, ...] = (row[column], -index, row)
+        else:
+            entry = (_Reversed((row[column], index)), row)
+
+        group_key = get_key(row)
+        heap = heaps.get(group_key)
+        if heap is None:
+            heaps[group_key] = [entry]
+        elif len(heap) < n:
+            heappush(heap, entry)
+        else:
+            heappushpop(heap, entry)
+
+    try:
+        group_keys = sorted(heaps)
+    except TypeError:
+        # group key values are scalars for single key, see key_getter
+        single_key = len(keys) == 1
+        group_keys = sorted(heaps, key=lambda values: comparable_key((values,) if single_key else values))
+    for group_key in group_keys:
+        heap = heaps.pop(group_key)
+        heap.sort(reverse=True)
+        for entry in heap:
+            yield entry[-1]
+
+
+def do_sort_top_n(endpoint: connection.Connection, keys: tp.Tuple[str, ...], column: str, n: int,
+                  ascending: bool, rings: tp.Optional[TRings] = None) -> None:
+    to_worker, from_worker = rings or (None, None)
+    rows = chain.from_iterable(received_batches(endpoint, to_worker))
+    send_rows(endpoint, select_top_n(rows, keys, column, n, ascending), from_worker)
 
 
 class ExternalSort(ops.Operation):
@@ -26,24 +169,108 @@ class ExternalSort(ops.Operation):
     This class illustrates cross-process streaming.
     """
 
-    def __init__(self, keys: tp.Sequence[str]):
+    def __init__(self, keys: tp.Sequence[str], limit: tp.Optional[int] = None):
+        """
+        :param keys: sorting keys
+        :param limit: if passed, only first limit rows of sorted sequence are yielded; they are selected
+            with bounded heap in main process instead of full sort
+        """
         self.keys = keys
+        self.limit = limit
 
     def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        """
+        :param rows: table rows
+        :param budget: memory budget; if passed, sort worker spills sorted runs to disk when its share is exceeded
+        :param shared_memory: pass rows to worker and back through shared memory ring buffers instead of pipe
+        """
+        if self.limit is not None:
+            yield from nsmallest(self.limit, rows, key=encoded_key_getter(self.keys))
+            return
+
+        budget: tp.Optional[MemoryBudget] = kwargs.get("budget")
+        shared_memory = kwargs.get("shared_memory", False)
+        if budget is None:
+            yield from self._process_remotely(rows, do_sort, (self.keys,), preserves_rows=True,
+                                              shared_memory=shared_memory)
+            return
+
+        granted = budget.acquire_operator_share()
+        try:
+            yield from self._process_remotely(rows, do_sort, (self.keys, granted, budget.pressure_event),
+                                              preserves_rows=True, shared_memory=shared_memory)
+        finally:
+            budget.release(granted)
+
+    def required_columns(self, downstream_columns: ops.TColumns) -> ops.TColumns:
+        if downstream_columns is None:
+            return None
+        return set(downstream_columns) | set(self.keys)
+
+    @staticmethod
+    def _process_remotely(rows: ops.TRowsIterable, target: tp.Callable[..., None], args: tp.Tuple[tp.Any, ...],
+                          preserves_rows: bool, shared_memory: bool = False) -> ops.TRowsGenerator:
+        """
+        Stream rows to worker process and yield rows sent back by it; rows are sent by batches with send_rows
+        :param rows: table rows
+        :param target: worker function, which is called with endpoint and args (and rings keyword argument)
+        :param args: additional arguments of worker function
+        :param preserves_rows: whether worker must send back exactly the same amount of rows
+        :param shared_memory: pass batches through pair of ring buffers (to worker and back)
+        """
+        rings: tp.Optional[TRings] = (RingBuffer(), RingBuffer()) if shared_memory else None
+        to_worker, from_worker = rings or (None, None)
         local_endpoint, remote_endpoint = Pipe()
-        process = Process(target=do_sort, args=(remote_endpoint, self.keys))
+        process = Process(target=target, args=(remote_endpoint,) + args, kwargs={"rings": rings})
         process.start()
-        row_count_before = 0
-        for row in rows:
-            local_endpoint.send(row)
-            row_count_before += 1
-        local_endpoint.send(None)
-        row_count_after = 0
-        while True:
-            local_endpoint_row = local_endpoint.recv()
-            if local_endpoint_row is None:
-                break
-            yield local_endpoint_row
-            row_count_after += 1
-        assert row_count_before == row_count_after
-        process.join()
+        try:
+            row_count_before = send_rows(local_endpoint, rows, to_worker)
+            row_count_after = 0
+            for batch in received_batches(local_endpoint, from_worker):
+                yield from batch
+                row_count_after += len(batch)
+            assert not preserves_rows or row_count_before == row_count_after
+        finally:
+            # generator may be closed before all rows are received, in this case worker is no longer needed
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            local_endpoint.close()
+            remote_endpoint.close()
+            for ring in rings or ():
+                ring.close()
+
+
+class SortTopN(ExternalSort):
+    """
+    Sort by keys leaving only top n rows by column value in every group. This is equivalent to sort by keys and
+    column followed by reduce with TopN reducer, but only bounded heap of rows per group is stored while data
+    streams through, so the full intermediate table is never sorted.
+    """
+
+    def __init__(self, keys: tp.Sequence[str], column: str, n: int, ascending: bool = True,
+                 in_memory: bool = False):
+        """
+        :param keys: keys to unite rows in groups
+        :param column: column name to get top by
+        :param n: number of top rows in every group
+        :param ascending: same as in TopN: True for largest values, False for smallest ones
+        :param in_memory: select rows in main process instead of separate one
+        """
+        super().__init__(keys)
+        self.column = column
+        self.n = n
+        self.ascending = ascending
+        self.in_memory = in_memory
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        if self.in_memory:
+            yield from select_top_n(rows, self.keys, self.column, self.n, self.ascending)
+        else:
+            yield from self._process_remotely(rows, do_sort_top_n, (self.keys, self.column, self.n, self.ascending),
+                                              preserves_rows=False, shared_memory=kwargs.get("shared_memory", False))
+
+    def required_columns(self, downstream_columns: ops.TColumns) -> ops.TColumns:
+        if downstream_columns is None:
+            return None
+        return set(downstream_columns) | set(self.keys) | {self.column}
@@ -1,6 +1,12 @@
 import typing as tp
 from . import operations as ops
-from .external_sort import ExternalSort
+from . import optimizer, pipeline, result_cache
+from .external_sort import ExternalSort, SortTopN
+from .memory_budget import MemoryBudget
+from .memory_watchdog import MemoryWatchdog
+from .prefetch import Prefetch
+from .result_cache import ResultCache
+from .sinks import Sink
 
 
 class Graph:
@@ -83,42 +89,230 @@ class Graph:
         output_graph.operations_lst = output_graph.operations_lst + [ExternalSort(keys)]
         return output_graph
 
-    def join(self, joiner: ops.Joiner, join_graph: 'Graph', keys: tp.Sequence[str]) -> 'Graph':
+    def sort_top_n(self, keys: tp.Sequence[str], column: str, n: int, ascending: bool = True,
+                   in_memory: bool = False) -> 'Graph':
+        """Construct new graph extended with sort by keys leaving only top n rows by column value in every group;
+        same as sort by keys and column followed by reduce with TopN reducer, but without full sort
+        :param keys: keys to unite rows in groups
+        :param column: column name to get top by
+        :param n: number of top rows in every group
+        :param ascending: same as in TopN: True for largest values, False for smallest ones
+        :param in_memory: select rows in main process instead of separate one
+        """
+        output_graph = self.copy()
+        output_graph.operations_lst = output_graph.operations_lst + [SortTopN(keys, column, n, ascending, in_memory)]
+        return output_graph
+
+    def distinct(self, keys: tp.Sequence[str], grouped_by: tp.Optional[tp.Sequence[str]] = None) -> 'Graph':
+        """Construct new graph extended with operation passing only the first row of every combination of key values;
+        rows are deduplicated with hash set in input order, without sorting
+        :param keys: keys to deduplicate by
+        :param grouped_by: keys (subset of keys) rows are known to be grouped by, then only keys of current group
+            are kept in memory
+        """
+        output_graph = self.copy()
+        output_graph.operations_lst = output_graph.operations_lst + [ops.Distinct(keys, grouped_by)]
+        return output_graph
+
+    def limit(self, n: int) -> 'Graph':
+        """Construct new graph extended with operation passing only first n rows; upstream computation is stopped
+        as soon as n rows are produced. Sort directly followed by limit selects n rows with bounded heap.
+        :param n: maximum amount of rows
+        """
+        output_graph = self.copy()
+        last_operation = output_graph.operations_lst[-1] if output_graph.operations_lst else None
+        if isinstance(last_operation, ExternalSort):
+            if last_operation.limit is not None:
+                n = min(n, last_operation.limit)
+            output_graph.operations_lst = output_graph.operations_lst[:-1] + [ExternalSort(last_operation.keys, n)]
+        else:
+            output_graph.operations_lst = output_graph.operations_lst + [ops.Limit(n)]
+        return output_graph
+
+    def join(self, joiner: ops.Joiner, join_graph: 'Graph', keys: tp.Sequence[str],
+             bloom_filter: bool = False) -> 'Graph':
         """Construct new graph extended with join operation with another graph
         :param joiner: join strategy to use
         :param join_graph: other graph to join with
         :param keys: keys for grouping
+        :param bloom_filter: for inner and right joins: consume join_graph (which should be the smaller one) first
+            and drop rows of this graph whose keys are not in it with Bloom filter; optimizer moves the filter
+            before sorts of this graph. This graph is not prepared concurrently with join_graph then
         """
-
         output_graph = self.copy()
-        output_graph.operations_lst = output_graph.operations_lst + [(ops.Join(joiner, keys), join_graph)]
+        if bloom_filter:
+            if not isinstance(joiner, (ops.InnerJoiner, ops.RightJoiner)):
+                raise ValueError("Bloom filter drops unmatched rows, so it is applicable to inner and right joins only")
+            semi_join_filter = ops.BloomSemiJoinFilter(keys)
+            output_graph.operations_lst = output_graph.operations_lst + [
+                ops.Map(semi_join_filter), (ops.Join(joiner, keys, semi_join_filter), join_graph)]
+        else:
+            output_graph.operations_lst = output_graph.operations_lst + [(ops.Join(joiner, keys), join_graph)]
         return output_graph
 
-    def run(self, **kwargs: tp.Any) -> tp.Union[tp.List[ops.TRow], ops.TRowsIterable]:
-        """Single method to start execution; data sources passed as kwargs"""
+    def run(self, sink: tp.Optional[Sink] = None, optimize: bool = True, concurrent_joins: bool = True,
+            pipelined: bool = False, memory_limit: tp.Optional[int] = None, cache: tp.Optional[ResultCache] = None,
+            checkpoint_dir: tp.Optional[str] = None, shared_memory: bool = False,
+            **kwargs: tp.Any) -> tp.Union[tp.List[ops.TRow], ops.TRowsIterable, int]:
+        """Single method to start execution; data sources passed as kwargs
+        :param sink: if passed, result rows are streamed into it and amount of rows consumed by sink is returned
+        :param optimize: optimize graph before execution, see optimizer module
+        :param concurrent_joins: prepare both inputs of every join concurrently in background threads, so sort
+            workers of both sides run at the same time; rows of iterator sources are copied in this mode, as
+            mappers change rows in place
+        :param pipelined: run chains of mappers in worker processes and read sources and sort results in background
+            threads, all connected with bounded queues, see pipeline module
+        :param memory_limit: memory budget in bytes for main and worker processes; sorts and joins draw their
+            buffers from it and spill to disk when it is exhausted or when memory usage nears the limit
+        :param cache: if passed, result of graph reading only files is taken from cache when neither graph nor
+            files changed, and is saved to cache otherwise, see result_cache module
+        :param checkpoint_dir: if passed, outputs of sorts and reduces of graph reading only files are saved to this
+            directory, and run interrupted before the result was consumed starts from the latest saved stage when
+            restarted; saved stages are removed when the result is consumed
+        :param shared_memory: pass rows to sort and mapper worker processes and back through shared memory ring
+            buffers, sending only control messages through pipes, see ring_buffer module
+        :param return_lst: if False, generator of result rows is returned instead of list
+        """
+        graph = optimizer.optimize(self) if optimize else self
+        if pipelined:
+            graph = pipeline.split_into_stages(graph)
+        has_joins = any(isinstance(operation, tuple) for operation in graph.operations_lst)
+
+        if checkpoint_dir is not None:
+            if cache is not None:
+                raise ValueError("cache and checkpoint_dir cannot be used together")
+            checkpoints: tp.Optional[ResultCache] = ResultCache(checkpoint_dir, max_bytes=None, cache_stages=True)
+            cache = checkpoints
+        else:
+            checkpoints = None
 
-        if self.input_type == "file":  # type: ignore
+        cached_result = None
+        if cache is not None:
+            key = result_cache.fingerprint(graph)
+            if key is not None:
+                cached_result = cache.get(key)
+
+        if cached_result is not None:
+            result: ops.TRowsIterable = cached_result
+        else:
+            budget = None
+            if memory_limit is not None:
+                budget = MemoryBudget(memory_limit)
+                watchdog = MemoryWatchdog(memory_limit, pressure_event=budget.pressure_event, include_children=True,
+                                          report=False)
+                watchdog.daemon = True
+                watchdog.start()
+
+            result = graph._execute(kwargs, concurrent_joins, copy_source_rows=concurrent_joins and has_joins,
+                                    budget=budget, cache=cache, store_result=checkpoints is None,
+                                    shared_memory=shared_memory)
+            if budget is not None:
+                result = self._stop_when_done(result, watchdog)
+        if checkpoints is not None:
+            result = self._clear_when_done(result, checkpoints)
+
+        if sink is not None:
+            return sink(result)
+        elif kwargs.get("return_lst", True):
+            return list(result)
+        else:
+            return result
+
+    @staticmethod
+    def _stop_when_done(rows: ops.TRowsIterable, watchdog: MemoryWatchdog) -> ops.TRowsGenerator:
+        try:
+            yield from rows
+        finally:
+            watchdog.stop()
+            watchdog.join()
+
+    @staticmethod
+    def _clear_when_done(rows: ops.TRowsIterable, checkpoints: ResultCache) -> ops.TRowsGenerator:
+        yield from rows
+        checkpoints.clear()
+
+    @staticmethod
+    def _is_stage_boundary(operation: tp.Any) -> bool:
+        """Whether output of operation is worth saving: it is expensive to compute and usually not too large"""
+        return isinstance(operation, (ExternalSort, ops.Reduce))
+
+    def _execute(self, kwargs: tp.Dict[str, tp.Any], concurrent_joins: bool, copy_source_rows: bool,
+                 budget: tp.Optional[MemoryBudget] = None, cache: tp.Optional[ResultCache] = None,
+                 store_result: bool = False, outer_state: tp.Optional[tp.Dict[int, tp.Any]] = None,
+                 shared_memory: bool = False) -> ops.TRowsIterable:
+        """Construct generator of graph result rows
+        :param kwargs: data sources
+        :param concurrent_joins: see run
+        :param copy_source_rows: copy rows of iterator source, as they may be shared with concurrent branches
+        :param budget: memory budget passed to operations
+        :param cache: cache to save result and, if it caches stages, outputs of stage boundaries to; execution
+            starts from the latest cached stage
+        :param store_result: save result to cache
+        :param outer_state: stateful objects of graph this graph is joined to, see result_cache.shared_state
+        :param shared_memory: see run
+        """
+        # positions of stage boundaries to save outputs of, with objects to save state of
+        stages: tp.Dict[int, tp.List[tp.Any]] = {}
+        if cache is not None and cache.cache_stages:
+            for position, operation in enumerate(self.operations_lst):
+                if self._is_stage_boundary(operation):
+                    shared = result_cache.shared_state(self, position + 1, outer_state)
+                    if shared is not None:
+                        stages[position] = shared
+
+        start = 0
+        cached_rows = None
+        for position in sorted(stages, reverse=True):
+            key = result_cache.fingerprint(self, position + 1)
+            cached_rows = cache.get(key, stages[position]) if cache is not None and key is not None else None
+            if cached_rows is not None:
+                start = position + 1
+                break
+
+        if cached_rows is not None:
+            row_iterator: ops.TRowsIterable = cached_rows
+        elif self.input_type == "file":  # type: ignore
             row_iterator_creator = self.file_fabric  # type: ignore
             row_iterator = row_iterator_creator(self.file_name, self.parser)  # type: ignore
         else:
             row_iterator_creator = kwargs[self.generator_name]  # type: ignore
             row_iterator = row_iterator_creator()
+            if copy_source_rows:
+                row_iterator = (row.copy() for row in row_iterator)
 
-        output_lst: tp.List[ops.TRowsGenerator] = [row_iterator]
-        for i, func in enumerate(self.operations_lst):
+        rows = row_iterator
+        stored_last = False
+        for position in range(start, len(self.operations_lst)):
+            func = self.operations_lst[position]
             args = []
-            if isinstance(func, tuple):  # operation is joi
-                send_kwargs = kwargs.copy()
-                send_kwargs["return_lst"] = False
-
-                graph2join = func[1].run(**send_kwargs)
+            if isinstance(func, tuple):  # operation is join
+                join_cache = None
+                join_outer_state = None
+                if cache is not None and cache.cache_stages:
+                    join_cache = cache
+                    other_operations = self.operations_lst[:position] + self.operations_lst[position + 1:]
+                    join_outer_state = {**result_cache.stateful_objects(other_operations), **(outer_state or {})}
+                graph2join = func[1]._execute(kwargs, concurrent_joins, copy_source_rows=concurrent_joins,
+                                              budget=budget, cache=join_cache, outer_state=join_outer_state,
+                                              shared_memory=shared_memory)
                 func = func[0]
+                if concurrent_joins:
+                    graph2join = Prefetch()(graph2join)
+                    # left rows must not be requested before semi-join filter is built from right ones
+                    if func.semi_join_filter is None:
+                        rows = Prefetch()(rows)
                 args.append(graph2join)
 
-            result = func(output_lst[i], *args)
-            output_lst.append(result)
+            rows = func(rows, *args, budget=budget, shared_memory=shared_memory)
+            stored_last = False
+            if cache is not None and position in stages:
+                key = result_cache.fingerprint(self, position + 1)
+                if key is not None:
+                    rows = cache.store(key, rows, stages[position])
+                    stored_last = True
 
-        if kwargs.get("return_lst", True):
-            return list(output_lst[-1])
-        else:
-            return output_lst[-1]
+        if cache is not None and store_result and not stored_last:
+            key = result_cache.fingerprint(self)
+            if key is not None:
+                rows = cache.store(key, rows)
+        return rows
@@ -1,11 +1,28 @@
 import typing as tp
 
+from operator import itemgetter
+
 TRow = tp.Dict[str, tp.Any]
 TRowsIterable = tp.Iterable[TRow]
 TRowsGenerator = tp.Generator[TRow, None, None]
 TGroupGenerator = tp.Generator[TRowsIterable, None, None]
 
 
+def _empty_key(row: TRow) -> tp.Tuple[()]:
+    return ()
+
+
+def key_getter(keys: tp.Sequence[str]) -> tp.Callable[[TRow], tp.Any]:
+    """
+    Construct function extracting values of keys from row
+    :param keys: names of key columns
+    :return: for one key - its value, for several keys - tuple of values, for no keys - empty tuple
+    """
+    if not keys:
+        return _empty_key
+    return itemgetter(*keys)
+
+
 class GroupsCreator:
     """Class used to unite rows into groups with same values of keys"""
 
@@ -16,14 +33,16 @@ class GroupsCreator:
         """
 
         self.keys = keys
-        self.rows_generator = (row for row in rows)
+        self.key_getter = key_getter(keys)
+        self.rows_generator = iter(rows)
 
-        self.group_key_values: tp.Tuple[tp.Any, ...] = tuple()
+        # single value for one key and tuple of values otherwise, see key_getter
+        self.group_key_values: tp.Any = tuple()
         self.first_group_element: tp.Optional[TRow] = None
 
         try:
             self.first_group_element = next(self.rows_generator)
-            self.group_key_values = tuple(self.first_group_element[key] for key in self.keys)
+            self.group_key_values = self.key_getter(self.first_group_element)
         except StopIteration:
             pass
 
@@ -47,10 +66,12 @@ class GroupsCreator:
 
         yield self.first_group_element
 
+        get_key = self.key_getter
+        group_key_values = self.group_key_values
         for row in self.rows_generator:
-            current_values = tuple(row[key] for key in self.keys)
+            current_values = get_key(row)
 
-            if current_values != self.group_key_values:
+            if current_values != group_key_values:
                 self.first_group_element = row
                 self.group_key_values = current_values
                 return
@@ -0,0 +1,129 @@
+import sys
+import tempfile
+import typing as tp
+
+from multiprocessing import Event
+from threading import Lock
+
+from .serialization import read_rows, write_rows
+
+OPERATOR_SHARE = 0.25  # part of the budget requested by single operator
+MIN_GRANT = 1024 ** 2  # operators always get at least this amount of bytes to work with
+GRANT_STEP = 64 * 1024  # buffers draw from budget by chunks of this size
+SPILL_BATCH_SIZE = 1024
+
+
+def row_size(row: tp.Dict[str, tp.Any]) -> int:
+    """
+    Approximate amount of memory taken by row
+    :param row: table row
+    """
+    size = sys.getsizeof(row)
+    for key, value in row.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+class MemoryBudget:
+    """
+    Global memory budget which memory-consuming operators (sort buffers, join group buffers) draw from.
+    Pressure event is set by MemoryWatchdog when memory usage nears the limit, then operators spill to disk early.
+    The event is shared with worker processes.
+    """
+
+    def __init__(self, limit: int) -> None:
+        """
+        :param limit: memory limit in bytes
+        """
+        self.limit = limit
+        self.pressure_event = Event()
+        self._available = limit
+        self._lock = Lock()
+
+    @property
+    def under_pressure(self) -> bool:
+        return self.pressure_event.is_set()
+
+    def acquire(self, amount: int, minimum: int = 0) -> int:
+        """
+        Take memory from budget
+        :param amount: amount of bytes wanted
+        :param minimum: amount of bytes granted even if budget is exhausted
+        :return: amount of bytes granted, which must be released afterwards
+        """
+        with self._lock:
+            granted = max(min(amount, self._available), minimum)
+            self._available -= granted
+            return granted
+
+    def release(self, amount: int) -> None:
+        """
+        Return memory to budget
+        :param amount: amount of bytes granted earlier
+        """
+        with self._lock:
+            self._available += amount
+
+    def acquire_operator_share(self) -> int:
+        """Take memory for buffer of single operator"""
+        return self.acquire(int(self.limit * OPERATOR_SHARE), MIN_GRANT)
+
+
+def write_spill(rows: tp.Iterable[tp.Dict[str, tp.Any]], file: tp.IO[bytes]) -> None:
+    """
+    Append rows to spill file
+    :param rows: table rows
+    :param file: binary file
+    """
+    write_rows(rows, file, SPILL_BATCH_SIZE)
+
+
+def read_spill(file: tp.IO[bytes]) -> tp.Generator[tp.Dict[str, tp.Any], None, None]:
+    """
+    Read rows from the beginning of spill file
+    :param file: binary file written with write_spill
+    """
+    file.seek(0)
+    yield from read_rows(file)
+
+
+class SpillableRows:
+    """Re-iterable buffer of rows, which keeps rows in memory while budget allows and spills the rest to disk"""
+
+    def __init__(self, rows: tp.Iterable[tp.Dict[str, tp.Any]], budget: MemoryBudget) -> None:
+        """
+        Consume all rows
+        :param rows: table rows
+        :param budget: memory budget to draw from
+        """
+        self.budget = budget
+        self.rows: tp.List[tp.Dict[str, tp.Any]] = []
+        self.spill_file: tp.Optional[tp.IO[bytes]] = None
+        self.granted = 0
+
+        used = 0
+        rows_iterator = iter(rows)
+        for row in rows_iterator:
+            used += row_size(row)
+            if used > self.granted and not budget.under_pressure:
+                self.granted += budget.acquire(GRANT_STEP)
+            if used > self.granted:
+                self.spill_file = tempfile.TemporaryFile()
+                write_spill([row], self.spill_file)
+                write_spill(rows_iterator, self.spill_file)
+                break
+            self.rows.append(row)
+
+    def __iter__(self) -> tp.Iterator[tp.Dict[str, tp.Any]]:
+        yield from self.rows
+        if self.spill_file is not None:
+            yield from read_spill(self.spill_file)
+
+    def close(self) -> None:
+        """Free memory and disk space"""
+        self.rows = []
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.budget.release(self.granted)
+        self.granted = 0
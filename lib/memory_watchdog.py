@@ -2,8 +2,9 @@ from os import environ, getpid
 from sys import stderr
 from threading import Thread, Event
 from time import sleep
+import typing as tp
 
-from psutil import Process
+from psutil import NoSuchProcess, Process
 
 VERBOSE = int(environ.get("VERBOSE", "0"))
 SLEEP_PERIOD = float(environ.get("WATCHDOG_PERIOD", "100")) / 1000.0  # in msec
@@ -17,11 +18,23 @@ class MemoryWatchdog(Thread):
     Watchdog may be configured using the environment variables above.
     """
 
-    def __init__(self, limit: int) -> None:
+    def __init__(self, limit: int, pressure_event: tp.Optional[tp.Any] = None, pressure_ratio: float = 0.8,
+                 include_children: bool = False, report: bool = True) -> None:
+        """
+        :param limit: memory limit in bytes
+        :param pressure_event: event to set while memory usage exceeds pressure_ratio of limit
+        :param pressure_ratio: part of limit after which memory is considered to be under pressure
+        :param include_children: account memory of child processes (e.g. sort workers) too
+        :param report: print maximum memory usage when stopped
+        """
         self._stop_event = Event()
         self.maximum_memory_usage = 0
         self.limit = limit
         self.limit_in_kib = limit // 1024
+        self.pressure_event = pressure_event
+        self.pressure_ratio = pressure_ratio
+        self.include_children = include_children
+        self.report = report
 
         if VERBOSE:
             # To not interfere with pytest output.
@@ -41,10 +54,16 @@ class MemoryWatchdog(Thread):
         while True:
             if self._stop_event.is_set():
                 break
-            usage = SELF_PROCESS.memory_info().rss
+            usage = self._memory_usage()
             usage_in_kib = usage // 1024
             self.maximum_memory_usage = max(self.maximum_memory_usage, usage)
 
+            if self.pressure_event is not None:
+                if usage > self.limit * self.pressure_ratio:
+                    self.pressure_event.set()
+                else:
+                    self.pressure_event.clear()
+
             if VERBOSE:
                 line = str(usage_in_kib).ljust(9) + "|" + "=" * min(WIDTH, usage * WIDTH // self.limit)
                 if usage > self.limit:
@@ -53,7 +72,18 @@ class MemoryWatchdog(Thread):
 
             sleep(SLEEP_PERIOD)
 
-        print("Maximum memory usage / limit (in KiB):", self.maximum_memory_usage, "/", self.limit, file=stderr)
+        if self.report:
+            print("Maximum memory usage / limit (in KiB):", self.maximum_memory_usage, "/", self.limit, file=stderr)
+
+    def _memory_usage(self) -> int:
+        usage = SELF_PROCESS.memory_info().rss
+        if self.include_children:
+            for child in SELF_PROCESS.children(recursive=True):
+                try:
+                    usage += child.memory_info().rss
+                except NoSuchProcess:
+                    pass
+        return int(usage)
 
     def stop(self) -> None:
         self._stop_event.set()
@@ -1,16 +1,27 @@
 from abc import abstractmethod, ABC
 import typing as tp
+import itertools
 import string
+import sys
+import tempfile
 from heapq import nlargest, nsmallest
-from .groups import GroupsCreator
+from .groups import GroupsCreator, key_getter
+from .memory_budget import GRANT_STEP, SPILL_BATCH_SIZE, MemoryBudget, SpillableRows, read_spill, write_spill
+from .sketches import BloomFilter, CountMinSketch, HyperLogLog, SpaceSaving
+from .sort_keys import comparable_key
 import math
 from math import sin, cos, sqrt, atan2, radians
 from datetime import datetime as dt
+from threading import Lock
 
 TRow = tp.Dict[str, tp.Any]
 TRowsIterable = tp.Iterable[TRow]
 TRowsGenerator = tp.Generator[TRow, None, None]
 TGroupGenerator = tp.Generator[TRowsIterable, None, None]
+# set of column names; None stands for all columns (or unknown set of columns)
+TColumns = tp.Optional[tp.AbstractSet[str]]
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
 
 
 class Operation(ABC):
@@ -18,6 +29,13 @@ class Operation(ABC):
     def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
         pass
 
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        """
+        Columns of input rows needed to produce downstream_columns of output rows; used by optimizer
+        :param downstream_columns: columns needed by downstream operations
+        """
+        return None
+
 
 # Operations
 
@@ -25,6 +43,9 @@ class Operation(ABC):
 class Mapper(ABC):
     """Base class for mappers"""
 
+    # whether mapper may be run in a worker process, see pipeline module
+    process_safe = True
+
     @abstractmethod
     def __call__(self, row: TRow) -> TRowsGenerator:
         """
@@ -32,6 +53,25 @@ class Mapper(ABC):
         """
         pass
 
+    def read_columns(self) -> TColumns:
+        """Columns mapper reads, None if unknown"""
+        return None
+
+    def written_columns(self) -> TColumns:
+        """Columns mapper adds or changes, None if unknown; other columns are passed through unchanged"""
+        return None
+
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        """
+        Columns of input row needed to produce downstream_columns of output rows
+        :param downstream_columns: columns needed by downstream operations
+        """
+        read_columns = self.read_columns()
+        written_columns = self.written_columns()
+        if downstream_columns is None or read_columns is None or written_columns is None:
+            return None
+        return (set(downstream_columns) - set(written_columns)) | set(read_columns)
+
 
 class Map(Operation):
     """Map class"""
@@ -51,6 +91,9 @@ class Map(Operation):
             for result_row in self.mapper(row):
                 yield result_row
 
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        return self.mapper.required_columns(downstream_columns)
+
 
 class Reducer(ABC):
     """Base class for reducers"""
@@ -62,6 +105,14 @@ class Reducer(ABC):
         """
         pass
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        """
+        Columns of input rows needed to produce downstream_columns of output rows
+        :param keys: keys rows are grouped by
+        :param downstream_columns: columns needed by downstream operations
+        """
+        return None
+
 
 class Reduce(Operation):
     """Reduce class"""
@@ -80,13 +131,17 @@ class Reduce(Operation):
         :param rows: table rows
         """
         groups_creator = GroupsCreator(rows, self.keys)
+        group_key = tuple(self.keys)
 
         while groups_creator.first_group_element is not None:
-            for result_row in self.reducer(tuple(self.keys), groups_creator.group_generator):
+            for result_row in self.reducer(group_key, groups_creator.group_generator):
                 yield result_row
 
             groups_creator.update_generator()
 
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        return self.reducer.required_columns(self.keys, downstream_columns)
+
 
 class Joiner(ABC):
     """Base class for joiners"""
@@ -105,56 +160,72 @@ class Joiner(ABC):
         pass
 
 
-def compare_key_values(first_values: tp.Tuple[tp.Any, ...],
-                       second_values: tp.Tuple[tp.Any, ...]) -> tp.Tuple[int, int]:
-    """
-    Lexicographically compare two dicts of key values
-    :param first_values: dict of key values
-    :param second_values: dict of key values
-    :return return 0 if values are equal, 1 if first_values is bigger, -1 otherwise
-    """
-    for first, second in zip(first_values, second_values):
-        if first < second:
-            return 0, 1
-        elif first > second:
-            return 1, 0
-
-    return 1, 1
-
-
 class Join(Operation):
     """Join class"""
 
-    def __init__(self, joiner: Joiner, keys: tp.Sequence[str]):
+    def __init__(self, joiner: Joiner, keys: tp.Sequence[str],
+                 semi_join_filter: tp.Optional['BloomSemiJoinFilter'] = None):
         """
         :param joiner: join strategy
         :param keys: keys to unite rows in groups.py
+        :param semi_join_filter: filter of left table rows to fill with keys of right table; right table is
+            consumed before the first left row is requested
         """
         self.keys = keys
         self.joiner = joiner
+        self.semi_join_filter = semi_join_filter
 
     def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
         """
         Construct join operation result generator
         :param rows: left table rows
         :param args: [right table rows]
+        :param budget: memory budget; if passed, groups of right table rows are spilled to disk when it is exceeded
         """
+        budget: tp.Optional[MemoryBudget] = kwargs.get("budget")
+        right_rows = args[0]
+        if self.semi_join_filter is not None:
+            right_rows = SpillableRows(right_rows, budget) if budget is not None else list(right_rows)
+            self.semi_join_filter.build(right_rows)
+        try:
+            yield from self._join(rows, right_rows, budget)
+        finally:
+            if isinstance(right_rows, SpillableRows):
+                right_rows.close()
+
+    def _join(self, rows: TRowsIterable, right_rows: TRowsIterable,
+              budget: tp.Optional[MemoryBudget]) -> TRowsGenerator:
         left_groups_creator = GroupsCreator(rows, self.keys)
-        right_groups_creator = GroupsCreator(args[0], self.keys)
+        right_groups_creator = GroupsCreator(right_rows, self.keys)
 
+        single_key = len(self.keys) == 1
         while left_groups_creator.first_group_element and right_groups_creator.first_group_element:
-            left_group_operand, right_group_operand = compare_key_values(left_groups_creator.group_key_values,
-                                                                         right_groups_creator.group_key_values)
-
-            if left_group_operand == right_group_operand:
-                for result_row in self.joiner(self.keys, left_groups_creator.group_generator,
-                                              right_groups_creator.group_generator):
-                    yield result_row
+            # groups are compared in the same order as ExternalSort orders rows, by binary encoding of key values
+            left_key_values = left_groups_creator.group_key_values
+            right_key_values = right_groups_creator.group_key_values
+            if single_key:
+                left_key_values = (left_key_values,)
+                right_key_values = (right_key_values,)
+            left_key_values = comparable_key(left_key_values)
+            right_key_values = comparable_key(right_key_values)
+
+            if left_key_values == right_key_values:
+                if budget is None:
+                    for result_row in self.joiner(self.keys, left_groups_creator.group_generator,
+                                                  right_groups_creator.group_generator):
+                        yield result_row
+                else:
+                    right_group = SpillableRows(right_groups_creator.group_generator, budget)
+                    try:
+                        for result_row in self.joiner(self.keys, left_groups_creator.group_generator, right_group):
+                            yield result_row
+                    finally:
+                        right_group.close()
 
                 left_groups_creator.update_generator()
                 right_groups_creator.update_generator()
 
-            elif left_group_operand > right_group_operand:
+            elif left_key_values > right_key_values:
                 for result_row in self.joiner(self.keys, [dict()], right_groups_creator.group_generator):
                     yield result_row
 
@@ -178,6 +249,161 @@ class Join(Operation):
 
             right_groups_creator.update_generator()
 
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        """
+        Columns needed from each of joined tables. Column is kept in both tables if it is needed by itself or with
+        any of suffixes, so the set of colliding columns (and thus output names) does not change.
+        """
+        if downstream_columns is None:
+            return None
+
+        columns = set(self.keys) | set(downstream_columns)
+        for column in downstream_columns:
+            for suffix in (self.joiner._a_suffix, self.joiner._b_suffix):
+                if suffix and column.endswith(suffix):
+                    columns.add(column[:-len(suffix)])
+        return columns
+
+
+class Limit(Operation):
+    """Limit class"""
+
+    def __init__(self, n: int) -> None:
+        """
+        :param n: maximum amount of rows to pass
+        """
+        self.n = n
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        """
+        Construct generator of first n rows; upstream generator is closed as soon as n rows are passed
+        :param rows: table rows
+        """
+        rows_iterator = iter(rows)
+        try:
+            # range goes first, so no extra row is requested from upstream
+            for _, row in zip(range(self.n), rows_iterator):
+                yield row
+        finally:
+            close = getattr(rows_iterator, "close", None)
+            if close is not None:
+                close()
+
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        return downstream_columns
+
+
+class Distinct(Operation):
+    """
+    Pass only the first row of every combination of key values. Seen keys are kept in a hash set, so rows are
+    passed in input order without sorting. If memory budget is exhausted, the set stops growing and rows with
+    unseen keys are spilled to partition files by hash of keys, which are deduplicated one by one afterwards.
+    """
+
+    def __init__(self, keys: tp.Sequence[str], grouped_by: tp.Optional[tp.Sequence[str]] = None,
+                 partitions: int = 16) -> None:
+        """
+        :param keys: keys to deduplicate by
+        :param grouped_by: keys (subset of keys) input is known to be grouped by, e.g. sorted by; then set of seen
+            keys is kept only for the current group, and memory is bounded by the largest group
+        :param partitions: amount of spill files
+        """
+        self.keys = keys
+        self.grouped_by = grouped_by
+        self.partitions = partitions
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        """
+        :param rows: table rows
+        :param budget: memory budget; if passed, set of seen keys draws from it and spills when it is exhausted
+        """
+        if self.grouped_by is not None:
+            yield from self._distinct_in_groups(rows)
+            return
+
+        budget: tp.Optional[MemoryBudget] = kwargs.get("budget")
+        get_key = key_getter(self.keys)
+        seen: tp.Set[tp.Any] = set()
+        granted = 0
+        used = 0
+        spill_files: tp.List[tp.IO[bytes]] = []
+        try:
+            rows_iterator = iter(rows)
+            for row in rows_iterator:
+                key = get_key(row)
+                if key in seen:
+                    continue
+                if budget is not None:
+                    used += self._key_size(key)
+                    if used > granted and not budget.under_pressure:
+                        granted += budget.acquire(GRANT_STEP)
+                    if used > granted:
+                        spill_files = self._spill(row, rows_iterator, get_key, seen)
+                        break
+                seen.add(key)
+                yield row
+
+            for spill_file in spill_files:
+                # keys of different partitions are different, so every partition is deduplicated on its own
+                seen = set()
+                for row in read_spill(spill_file):
+                    key = get_key(row)
+                    if key not in seen:
+                        seen.add(key)
+                        yield row
+        finally:
+            for spill_file in spill_files:
+                spill_file.close()
+            if budget is not None:
+                budget.release(granted)
+
+    def _spill(self, first_row: TRow, rows: tp.Iterator[TRow], get_key: tp.Callable[[TRow], tp.Any],
+               seen: tp.Set[tp.Any]) -> tp.List[tp.IO[bytes]]:
+        """Write the first row and the rest rows with keys not seen yet to partition files"""
+        spill_files = [tempfile.TemporaryFile() for _ in range(self.partitions)]
+        batches: tp.List[tp.List[TRow]] = [[] for _ in range(self.partitions)]
+        for row in itertools.chain([first_row], rows):
+            key = get_key(row)
+            if key in seen:
+                continue
+            partition = hash(key) % self.partitions
+            batches[partition].append(row)
+            if len(batches[partition]) >= SPILL_BATCH_SIZE:
+                write_spill(batches[partition], spill_files[partition])
+                batches[partition] = []
+        for batch, spill_file in zip(batches, spill_files):
+            write_spill(batch, spill_file)
+        return spill_files
+
+    @staticmethod
+    def _key_size(key: tp.Any) -> int:
+        """Approximate amount of memory taken by key in set"""
+        size = sys.getsizeof(key) + 2 * sys.getsizeof(0)  # entry of set table: hash and pointer
+        if isinstance(key, tuple):
+            size += sum(sys.getsizeof(value) for value in key)
+        return size
+
+    def _distinct_in_groups(self, rows: TRowsIterable) -> TRowsGenerator:
+        assert self.grouped_by is not None
+        get_group = key_getter(self.grouped_by)
+        get_key = key_getter(self.keys)
+        seen: tp.Set[tp.Any] = set()
+        current_group: tp.Any = None
+        for row in rows:
+            group = get_group(row)
+            if group != current_group:
+                seen = set()
+                current_group = group
+            key = get_key(row)
+            if key not in seen:
+                seen.add(key)
+                yield row
+
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        if downstream_columns is None:
+            return None
+        return set(downstream_columns) | set(self.keys)
+
 
 # Dummy operators
 
@@ -188,6 +414,12 @@ class DummyMapper(Mapper):
     def __call__(self, row: TRow) -> TRowsGenerator:
         yield row
 
+    def read_columns(self) -> TColumns:
+        return set()
+
+    def written_columns(self) -> TColumns:
+        return set()
+
 
 class FirstReducer(Reducer):
     """Yield only first row from passed ones"""
@@ -197,6 +429,11 @@ class FirstReducer(Reducer):
             yield row
             break
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        if downstream_columns is None:
+            return None
+        return set(keys) | set(downstream_columns)
+
 
 # Mappers
 
@@ -212,9 +449,15 @@ class FilterPunctuation(Mapper):
 
     def __call__(self, row: TRow) -> TRowsGenerator:
         string_ = row.get(self.column, "")
-        row[self.column] = string_.translate(str.maketrans("", "", string.punctuation))
+        row[self.column] = string_.translate(PUNCTUATION_TABLE)
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.column}
+
+    def written_columns(self) -> TColumns:
+        return {self.column}
+
 
 class LowerCase(Mapper):
     """Replace column value with value in lower case"""
@@ -233,6 +476,12 @@ class LowerCase(Mapper):
         row[self.column] = self._lower_case(row.get(self.column, ""))
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.column}
+
+    def written_columns(self) -> TColumns:
+        return {self.column}
+
 
 class InverseFrequency(Mapper):
     """inverse frequency """
@@ -251,6 +500,12 @@ class InverseFrequency(Mapper):
         row[self.res_row] = math.log(row[self.elements_amount_column] / row[self.encountered_elements_amount_column])
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.elements_amount_column, self.encountered_elements_amount_column}
+
+    def written_columns(self) -> TColumns:
+        return {self.res_row}
+
 
 class CalculateDistance(Mapper):
     """Calculate distance by coordinates in kilometres"""
@@ -283,6 +538,12 @@ class CalculateDistance(Mapper):
         row[self.distance_column] = 2 * earth_radius * atan2(sqrt(trigonometry_term), sqrt(1 - trigonometry_term))
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.first_coordinate, self.second_coordinate}
+
+    def written_columns(self) -> TColumns:
+        return {self.distance_column}
+
 
 class WeekDay(Mapper):
     """Get day of the week by date"""
@@ -302,6 +563,12 @@ class WeekDay(Mapper):
             row[self.week_day_column] = dt.strptime(row[self.date_column], "%Y%m%dT%H%M%S").strftime("%A")[:3]
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.date_column}
+
+    def written_columns(self) -> TColumns:
+        return {self.week_day_column}
+
 
 class Hour(Mapper):
     """Get hour by date"""
@@ -321,6 +588,12 @@ class Hour(Mapper):
             row[self.hour_column] = dt.strptime(row[self.date_column], "%Y%m%dT%H%M%S").hour
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.date_column}
+
+    def written_columns(self) -> TColumns:
+        return {self.hour_column}
+
 
 class TimeDelta(Mapper):
     """Calculate time delta between dates in seconds"""
@@ -349,6 +622,12 @@ class TimeDelta(Mapper):
         row[self.time_delta_column] = (exit_time - enter_time).total_seconds()
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.start_date_col, self.end_date_col}
+
+    def written_columns(self) -> TColumns:
+        return {self.time_delta_column}
+
 
 class Speed(Mapper):
     """Calculate speed in kilometres per hour"""
@@ -367,6 +646,12 @@ class Speed(Mapper):
         row[self.speed_column] = row[self.distance_column] / row[self.time_column] * (60 ** 2)
         yield row
 
+    def read_columns(self) -> TColumns:
+        return {self.distance_column, self.time_column}
+
+    def written_columns(self) -> TColumns:
+        return {self.speed_column}
+
 
 class Split(Mapper):
     """Split row on multiple rows by separator"""
@@ -386,6 +671,71 @@ class Split(Mapper):
             new_row[self.column] = substr
             yield new_row
 
+    def read_columns(self) -> TColumns:
+        return {self.column}
+
+    def written_columns(self) -> TColumns:
+        return {self.column}
+
+
+class Tokenize(Mapper):
+    """
+    Remove punctuation, lower case and split text into words in one pass; equivalent to FilterPunctuation,
+    LowerCase and Split applied one after another, but yields only columns needed
+    """
+
+    def __init__(self, column: str, keep_columns: tp.Optional[tp.Sequence[str]] = None,
+                 count_column: tp.Optional[str] = None, separator: tp.Optional[str] = None) -> None:
+        """
+        :param column: name of column with text; words are written to the same column
+        :param keep_columns: columns of input row copied to every word row, None for all columns
+        :param count_column: if passed, single row is yielded for every distinct word of text, with amount
+            of its occurrences in this column
+        :param separator: string to separate words by
+        """
+        self.column = column
+        self.keep_columns = keep_columns
+        self.count_column = count_column
+        self.separator = separator
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        words = row.get(self.column, "").translate(PUNCTUATION_TABLE).lower().split(self.separator)
+        if self.keep_columns is None:
+            base_row = row
+        else:
+            base_row = {column: row[column] for column in self.keep_columns}
+
+        if self.count_column is None:
+            for word in words:
+                new_row = base_row.copy()
+                new_row[self.column] = word
+                yield new_row
+        else:
+            counts: tp.Dict[str, int] = {}
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+            for word, count in counts.items():
+                new_row = base_row.copy()
+                new_row[self.column] = word
+                new_row[self.count_column] = count
+                yield new_row
+
+    def read_columns(self) -> TColumns:
+        if self.keep_columns is None:
+            return {self.column}
+        return {self.column} | set(self.keep_columns)
+
+    def written_columns(self) -> TColumns:
+        columns = {self.column}
+        if self.count_column is not None:
+            columns.add(self.count_column)
+        return columns
+
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        if self.keep_columns is None:
+            return super().required_columns(downstream_columns)
+        return self.read_columns()
+
 
 class Product(Mapper):
     """Calculates product of multiple columns"""
@@ -405,37 +755,211 @@ class Product(Mapper):
             row[self.result_column] *= row[column]
         yield row
 
+    def read_columns(self) -> TColumns:
+        return set(self.columns)
+
+    def written_columns(self) -> TColumns:
+        return {self.result_column}
+
 
 class Filter(Mapper):
     """Remove records that don"t satisfy some condition"""
 
-    def __init__(self, condition: tp.Callable[[TRow], bool]) -> None:
+    def __init__(self, condition: tp.Callable[[TRow], bool], columns: tp.Optional[tp.Sequence[str]] = None) -> None:
         """
         :param condition: if condition is not true - remove record
+        :param columns: names of columns condition depends on; if passed, optimizer may move filter
+            to earlier stages of graph
         """
         self.condition = condition
+        self.columns = columns
 
     def __call__(self, row: TRow) -> TRowsGenerator:
         if self.condition(row):
             yield row
 
+    def read_columns(self) -> TColumns:
+        return None if self.columns is None else set(self.columns)
+
+    def written_columns(self) -> TColumns:
+        return set()
+
+
+class BloomSemiJoinFilter(Filter):
+    """
+    Filter of rows whose keys may be present in another table, built by Join from that table with Bloom filter.
+    Placed before inner join, it is moved by optimizer before sorts of left table, so that rows without match
+    are dropped before being sorted. Filter must not be applied before Join consumed right table
+    """
+
+    # filter is built in main process after worker processes are started
+    process_safe = False
+    _transient_attributes = ("bloom_filter",)
+
+    def __init__(self, keys: tp.Sequence[str], error_rate: float = 0.01) -> None:
+        """
+        :param keys: join keys
+        :param error_rate: share of rows without match which are passed nevertheless
+        """
+        super().__init__(self._may_match, keys)
+        self.keys = keys
+        self.error_rate = error_rate
+        self.get_key = key_getter(keys)
+        self.bloom_filter: tp.Optional[BloomFilter] = None
+
+    def build(self, rows: TRowsIterable) -> None:
+        """
+        Fill filter with keys of rows
+        :param rows: re-iterable rows of right table
+        """
+        bloom_filter = BloomFilter(sum(1 for _ in rows), self.error_rate)
+        for row in rows:
+            bloom_filter.add(self.get_key(row))
+        self.bloom_filter = bloom_filter
+
+    def _may_match(self, row: TRow) -> bool:
+        if self.bloom_filter is None:
+            raise RuntimeError("Semi-join filter is applied before join consumed its right table")
+        return self.get_key(row) in self.bloom_filter
+
 
 class Project(Mapper):
     """Leave only mentioned columns"""
 
-    def __init__(self, columns: tp.Sequence[str]) -> None:
+    def __init__(self, columns: tp.Sequence[str], skip_missing: bool = False) -> None:
         """
         :param columns: names of columns
+        :param skip_missing: do not fail on columns absent in row
         """
         self.columns = columns
+        self.skip_missing = skip_missing
 
     def __call__(self, row: TRow) -> TRowsGenerator:
         result_row = {}
-        for column in self.columns:
-            result_row[column] = row[column]
+        if self.skip_missing:
+            for column in self.columns:
+                if column in row:
+                    result_row[column] = row[column]
+        else:
+            for column in self.columns:
+                result_row[column] = row[column]
 
         yield result_row
 
+    def read_columns(self) -> TColumns:
+        return set(self.columns)
+
+    def written_columns(self) -> TColumns:
+        return set()
+
+    def required_columns(self, downstream_columns: TColumns) -> TColumns:
+        return set(self.columns)
+
+
+class StringDictionary:
+    """
+    Two-way mapping between strings and integer ids, shared by EncodeStrings and DecodeStrings mappers.
+    Ids are assigned in order of first occurrence, so their order differs from order of strings.
+    Encoding is thread-safe, which allows concurrent branches of graph to share dictionary.
+    """
+
+    # ids depend on order rows were encoded in, they are not part of graph plan, see result_cache
+    _transient_attributes = ("_ids", "_strings", "_lock")
+
+    def __init__(self) -> None:
+        self._ids: tp.Dict[str, int] = {}
+        self._strings: tp.List[str] = []
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def encode(self, value: str) -> int:
+        string_id = self._ids.get(value)
+        if string_id is None:
+            with self._lock:
+                string_id = self._ids.get(value)
+                if string_id is None:
+                    string_id = len(self._strings)
+                    self._strings.append(value)
+                    self._ids[value] = string_id
+        return string_id
+
+    def decode(self, string_id: int) -> str:
+        return self._strings[string_id]
+
+    def checkpoint_state(self) -> tp.List[str]:
+        """Strings in order of ids, saved with checkpoints of rows holding encoded strings, see result_cache"""
+        with self._lock:
+            return list(self._strings)
+
+    def restore_state(self, strings: tp.List[str]) -> bool:
+        """
+        Assign ids of saved dictionary, which may be ahead of this one or behind it
+        :param strings: result of checkpoint_state
+        :return: False if ids already assigned differ from saved ones
+        """
+        with self._lock:
+            common = min(len(strings), len(self._strings))
+            if strings[:common] != self._strings[:common]:
+                return False
+            for value in strings[common:]:
+                self._ids[value] = len(self._strings)
+                self._strings.append(value)
+            return True
+
+
+class EncodeStrings(Mapper):
+    """
+    Replace strings in column with integer ids, so that sorts, joins and reduces compare and pass integers.
+    Rows must be decoded with DecodeStrings using the same dictionary before sorting by column in string order
+    """
+
+    # dictionary of worker process would not be seen by main process
+    process_safe = False
+
+    def __init__(self, column: str, dictionary: StringDictionary) -> None:
+        """
+        :param column: name of column with strings
+        :param dictionary: dictionary to assign ids with
+        """
+        self.column = column
+        self.dictionary = dictionary
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        row[self.column] = self.dictionary.encode(row[self.column])
+        yield row
+
+    def read_columns(self) -> TColumns:
+        return {self.column}
+
+    def written_columns(self) -> TColumns:
+        return {self.column}
+
+
+class DecodeStrings(Mapper):
+    """Replace integer ids in column with strings they were assigned to by EncodeStrings"""
+
+    process_safe = False
+
+    def __init__(self, column: str, dictionary: StringDictionary) -> None:
+        """
+        :param column: name of column with ids
+        :param dictionary: dictionary ids were assigned with
+        """
+        self.column = column
+        self.dictionary = dictionary
+
+    def __call__(self, row: TRow) -> TRowsGenerator:
+        row[self.column] = self.dictionary.decode(row[self.column])
+        yield row
+
+    def read_columns(self) -> TColumns:
+        return {self.column}
+
+    def written_columns(self) -> TColumns:
+        return {self.column}
+
 
 # Reducers
 
@@ -460,6 +984,11 @@ class TopN(Reducer):
             for row in nsmallest(self.n, rows, key=lambda dict_: dict_[self.column_max]):
                 yield row
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        if downstream_columns is None:
+            return None
+        return set(keys) | set(downstream_columns) | {self.column_max}
+
 
 class TermFrequency(Reducer):
     """Calculate frequency of values in column"""
@@ -494,6 +1023,9 @@ class TermFrequency(Reducer):
             result[self.result_column] = words_counter[key] / words_amount
             yield result
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.words_column}
+
 
 class Count(Reducer):
     """Count rows passed and yield single row as a result"""
@@ -519,6 +1051,9 @@ class Count(Reducer):
         ans[self.column] = counter
         yield ans
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys)
+
 
 class Sum(Reducer):
     """Sum values in column passed and yield single row as a result"""
@@ -541,6 +1076,9 @@ class Sum(Reducer):
 
         yield ans
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.column}
+
 
 class Mean(Reducer):
     """Mean values in column passed and yield single row as a result"""
@@ -568,6 +1106,131 @@ class Mean(Reducer):
 
         yield ans
 
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.column}
+
+
+class ApproximateCountDistinct(Reducer):
+    """
+    Estimate amount of distinct values in column with HyperLogLog sketch and yield single row as a result.
+    Memory is bounded by error, so with empty keys it counts distinct values of the whole table without sorting
+    """
+
+    def __init__(self, column: str, result_column: str = "count_distinct", error: float = 0.01) -> None:
+        """
+        :param column: name of column with values
+        :param result_column: name of column to save estimate in
+        :param error: relative standard error of estimate
+        """
+        self.column = column
+        self.result_column = result_column
+        self.error = error
+
+    def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        sketch = HyperLogLog(self.error)
+        ans: TRow = dict()
+        for row in rows:
+            if not ans:
+                ans = {key: row[key] for key in group_key}
+            sketch.add(row[self.column])
+
+        ans[self.result_column] = round(sketch.estimate())
+        yield ans
+
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.column}
+
+
+class ApproximateTopK(Reducer):
+    """
+    Find k most frequent values in column with Space-Saving algorithm and yield them with estimated counts,
+    most frequent first. Counts are overestimated by at most (amount of rows) / capacity
+    """
+
+    def __init__(self, column: str, k: int, count_column: str = "count", capacity: tp.Optional[int] = None) -> None:
+        """
+        :param column: name of column with values
+        :param k: amount of values
+        :param count_column: name of column to save count estimates in
+        :param capacity: amount of counters kept, 10 * k by default
+        """
+        self.column = column
+        self.k = k
+        self.count_column = count_column
+        self.capacity = capacity if capacity is not None else 10 * k
+
+    def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        sketch = SpaceSaving(self.capacity)
+        key_values: TRow = dict()
+        for row in rows:
+            if not key_values:
+                key_values = {key: row[key] for key in group_key}
+            sketch.add(row[self.column])
+
+        for value, count, _ in sketch.top(self.k):
+            ans = key_values.copy()
+            ans[self.column] = value
+            ans[self.count_column] = count
+            yield ans
+
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.column}
+
+
+class HeavyHitters(Reducer):
+    """
+    Find values of column occurring in more than fraction of rows with Count-Min sketch and yield them with
+    estimated counts, most frequent first. Only candidates whose estimate exceeds the threshold are kept, so
+    memory is bounded by sketch size and 2 / fraction candidates. Counts are overestimated by at most
+    epsilon * (amount of rows) with probability 1 - delta, so values slightly below the threshold may be yielded
+    """
+
+    def __init__(self, column: str, fraction: float, count_column: str = "count", epsilon: float = 0.001,
+                 delta: float = 0.01) -> None:
+        """
+        :param column: name of column with values
+        :param fraction: minimum share of rows with value
+        :param count_column: name of column to save count estimates in
+        :param epsilon: error of counts relative to amount of rows
+        :param delta: probability of error exceeding epsilon
+        """
+        self.column = column
+        self.fraction = fraction
+        self.count_column = count_column
+        self.epsilon = epsilon
+        self.delta = delta
+
+    def __call__(self, group_key: tp.Tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
+        sketch = CountMinSketch(self.epsilon, self.delta)
+        candidates: tp.Dict[tp.Any, int] = {}
+        max_candidates = math.ceil(2 / self.fraction)
+        key_values: TRow = dict()
+        for row in rows:
+            if not key_values:
+                key_values = {key: row[key] for key in group_key}
+            value = row[self.column]
+            estimate = sketch.add(value)
+            if estimate > self.fraction * sketch.total:
+                candidates[value] = estimate
+                if len(candidates) > max_candidates:
+                    candidates = self._above_threshold(sketch, candidates)
+
+        candidates = self._above_threshold(sketch, candidates)
+        for value, count in sorted(candidates.items(), key=lambda item: item[1], reverse=True):
+            ans = key_values.copy()
+            ans[self.column] = value
+            ans[self.count_column] = count
+            yield ans
+
+    def _above_threshold(self, sketch: CountMinSketch, candidates: tp.Dict[tp.Any, int]) -> tp.Dict[tp.Any, int]:
+        """Candidates with current estimates exceeding threshold"""
+        threshold = self.fraction * sketch.total
+        estimates = {value: sketch.estimate(value) for value in candidates}
+        return {value: count for value, count in estimates.items() if count > threshold}
+
+    def required_columns(self, keys: tp.Sequence[str], downstream_columns: TColumns) -> TColumns:
+        return set(keys) | {self.column}
+
 
 # Joiners
 
@@ -608,6 +1271,13 @@ def merge_two_dicts_by_keys(a_row: TRow, b_row: TRow, suffix_a: str, suffix_b: s
     return merged_dct
 
 
+def _reiterable(rows: TRowsIterable) -> TRowsIterable:
+    """Materialize rows to iterate over them several times, unless they are already buffered"""
+    if isinstance(rows, SpillableRows):
+        return rows
+    return tuple(rows)
+
+
 class InnerJoiner(Joiner):
     """Join with inner strategy"""
 
@@ -615,7 +1285,7 @@ class InnerJoiner(Joiner):
         left_dict_is_none = rows_a == [dict()]
         right_dict_is_none = rows_b == [dict()]
 
-        rows_b = tuple(rows_b)
+        rows_b = _reiterable(rows_b)
 
         for row_a in rows_a:
             for row_b in rows_b:
@@ -627,7 +1297,7 @@ class OuterJoiner(Joiner):
     """Join with outer strategy"""
 
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        rows_b = tuple(rows_b)
+        rows_b = _reiterable(rows_b)
 
         for row_a in rows_a:
             for row_b in rows_b:
@@ -639,7 +1309,7 @@ class LeftJoiner(Joiner):
 
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
         left_dict_is_none = rows_a == [dict()]
-        rows_b = tuple(rows_b)
+        rows_b = _reiterable(rows_b)
 
         for row_a in rows_a:
             for row_b in rows_b:
@@ -652,7 +1322,7 @@ class RightJoiner(Joiner):
 
     def __call__(self, keys: tp.Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
         right_dict_is_none = rows_b == [dict()]
-        rows_b = tuple(rows_b)
+        rows_b = _reiterable(rows_b)
 
         for row_a in rows_a:
             for row_b in rows_b:
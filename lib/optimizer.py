@@ -0,0 +1,116 @@
+"""
+Logical optimization of graph operations list before execution.
+
+Rules applied:
+ - filters with known columns are moved to earlier stages: before sorts, before mappers which do not change
+   columns filter depends on, before deduplication by keys filter depends on, and into both joined graphs
+   if filter depends only on join keys;
+ - projections on columns needed downstream are inserted before sorts, so sort workers receive only these
+   columns. Projection costs one dict construction per row, which is cheaper than serialization of unused
+   columns, so projections are not inserted anywhere else.
+"""
+import typing as tp
+
+from . import operations as ops
+from .external_sort import ExternalSort
+
+if tp.TYPE_CHECKING:
+    from .graph import Graph  # noqa
+
+
+def _filter_columns(operation: tp.Any) -> ops.TColumns:
+    """Columns read by filter operation, None if operation is not a filter with known columns"""
+    if isinstance(operation, ops.Map) and isinstance(operation.mapper, ops.Filter):
+        return operation.mapper.read_columns()
+    return None
+
+
+def _commutes_with_filter(operation: tp.Any, filter_columns: tp.AbstractSet[str]) -> bool:
+    """Whether filter depending on filter_columns may be applied before operation instead of after it"""
+    if type(operation) is ExternalSort:
+        # limited sort selects rows, so filter applied before it changes the result
+        return operation.limit is None
+    if isinstance(operation, ops.Distinct):
+        # rows with equal keys are either all removed by filter depending only on keys, or all kept
+        return set(filter_columns) <= set(operation.keys)
+    if isinstance(operation, ops.Map):
+        written_columns = operation.mapper.written_columns()
+        return written_columns is not None and not set(written_columns) & set(filter_columns)
+    return False
+
+
+def _extended(graph: 'Graph', operation: tp.Any) -> 'Graph':
+    output_graph = graph.copy()
+    output_graph.operations_lst = output_graph.operations_lst + [operation]
+    return output_graph
+
+
+def push_down_filters(operations: tp.List[tp.Any]) -> tp.List[tp.Any]:
+    """
+    Move filters with known columns to earliest possible positions
+    :param operations: graph operations list
+    :return: new operations list
+    """
+    result: tp.List[tp.Any] = []
+    for operation in operations:
+        columns = _filter_columns(operation)
+        if columns is None:
+            result.append(operation)
+            continue
+
+        position = len(result)
+        while position > 0:
+            previous = result[position - 1]
+            if isinstance(previous, tuple):
+                # key columns are equal in both joined rows, so filter by keys may be applied to both graphs;
+                # but joined graph is prefetched, while semi-join filter is built only when its own join starts
+                join, join_graph = previous
+                if not set(columns) <= set(join.keys) or isinstance(operation.mapper, ops.BloomSemiJoinFilter):
+                    break
+                result[position - 1] = (join, _extended(join_graph, operation))
+            elif not _commutes_with_filter(previous, columns):
+                break
+            position -= 1
+        result.insert(position, operation)
+
+    return result
+
+
+def optimize(graph: 'Graph', downstream_columns: ops.TColumns = None) -> 'Graph':
+    """
+    Construct optimized copy of graph; graph itself is not changed
+    :param graph: graph to optimize
+    :param downstream_columns: columns of graph output needed, None for all columns
+    """
+    operations = push_down_filters(graph.operations_lst)
+
+    inserted_projections = set()
+    reversed_operations: tp.List[tp.Any] = []
+    columns = downstream_columns
+    for operation in reversed(operations):
+        if isinstance(operation, tuple):
+            join, join_graph = operation
+            columns = join.required_columns(columns)
+            reversed_operations.append((join, optimize(join_graph, columns)))
+            continue
+
+        reversed_operations.append(operation)
+        columns = operation.required_columns(columns)
+        if isinstance(operation, ExternalSort) and columns is not None:
+            projection = ops.Map(ops.Project(sorted(columns), skip_missing=True))
+            inserted_projections.add(id(projection))
+            reversed_operations.append(projection)
+
+    optimized_operations: tp.List[tp.Any] = []
+    for operation in reversed(reversed_operations):
+        if id(operation) in inserted_projections and optimized_operations:
+            # projection written by hand may already leave only needed columns
+            previous = optimized_operations[-1]
+            if isinstance(previous, ops.Map) and isinstance(previous.mapper, ops.Project) \
+                    and set(previous.mapper.columns) <= set(operation.mapper.columns):
+                continue
+        optimized_operations.append(operation)
+
+    output_graph = graph.copy()
+    output_graph.operations_lst = optimized_operations
+    return output_graph
@@ -0,0 +1,183 @@
+"""
+Pipelined execution: graph operations are split into stages connected by bounded queues, so that parsing,
+mapping and sorting overlap. Chains of mappers (CPU-bound) are run in worker processes, reading of sources
+and of sort results (I/O-bound) is done in background threads. Mappers which are not process-safe (e.g. ones
+sharing state with other mappers) stay in the main process.
+"""
+import typing as tp
+
+from multiprocessing import Pipe, Process, connection
+from threading import Thread
+
+from . import operations as ops
+from .external_sort import ExternalSort
+from .external_sort import TRings
+from .prefetch import Prefetch
+from .ring_buffer import RingBuffer
+from .serialization import decode_batch, encode_batch
+from .sinks import batches
+
+if tp.TYPE_CHECKING:
+    from .graph import Graph  # noqa
+
+
+def do_map(endpoint: connection.Connection, operations: tp.Sequence[ops.Operation],
+           rings: tp.Optional[TRings] = None) -> None:
+    """
+    Apply operations to batches received from endpoint and send results back
+    :param rings: if passed, encoded batches are received through the first ring and sent through the second one
+    """
+    to_worker, from_worker = rings or (None, None)
+    while True:
+        if to_worker is None:
+            batch = endpoint.recv()
+        else:
+            data = to_worker.recv(endpoint)
+            batch = decode_batch(data) if data is not None else None
+        if batch is None:
+            break
+        rows: ops.TRowsIterable = batch
+        try:
+            for operation in operations:
+                rows = operation(rows)
+            if from_worker is None:
+                endpoint.send(list(rows))
+            else:
+                from_worker.send(endpoint, encode_batch(list(rows)))
+        except Exception as e:
+            if from_worker is None:
+                endpoint.send(e)
+            else:
+                from_worker.send_error(endpoint, e)
+            return
+    if from_worker is None:
+        endpoint.send(None)
+    else:
+        from_worker.send_end(endpoint)
+
+
+class ProcessMap(ops.Operation):
+    """Apply chain of map operations in a separate process, passing rows by batches"""
+
+    def __init__(self, operations: tp.Sequence[ops.Map], batch_size: int = 256) -> None:
+        """
+        :param operations: map operations to apply one after another
+        :param batch_size: amount of rows sent to worker at once
+        """
+        self.operations = operations
+        self.batch_size = batch_size
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        """
+        :param rows: table rows
+        :param shared_memory: pass batches to worker and back through shared memory ring buffers instead of pipe
+        """
+        rings: tp.Optional[TRings] = (RingBuffer(), RingBuffer()) if kwargs.get("shared_memory", False) else None
+        to_worker, from_worker = rings or (None, None)
+        local_endpoint, remote_endpoint = Pipe()
+        process = Process(target=do_map, args=(remote_endpoint, self.operations), kwargs={"rings": rings})
+        process.start()
+        # worker owns its end of pipe, so terminated worker makes feeder fail instead of blocking forever
+        remote_endpoint.close()
+        errors: tp.List[BaseException] = []
+        # worker blocks on sending results when they are not consumed, which in turn blocks feeder
+        feeder = Thread(target=self._feed, args=(rows, local_endpoint, errors, to_worker), daemon=True)
+        feeder.start()
+        try:
+            while True:
+                if from_worker is None:
+                    batch = local_endpoint.recv()
+                else:
+                    data = from_worker.recv(local_endpoint)
+                    batch = decode_batch(data) if data is not None else None
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+            feeder.join()
+            if errors:
+                raise errors[0]
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            local_endpoint.close()
+            # ring to worker is closed by feeder, as it may still be writing to it
+            if from_worker is not None:
+                from_worker.close()
+
+    def _feed(self, rows: ops.TRowsIterable, endpoint: connection.Connection, errors: tp.List[BaseException],
+              ring: tp.Optional[RingBuffer]) -> None:
+        try:
+            self._send_batches(rows, endpoint, errors, ring)
+        finally:
+            # worker keeps its own mapping of shared memory, so ring can be closed as soon as it is written
+            if ring is not None:
+                ring.close()
+
+    def _send_batches(self, rows: ops.TRowsIterable, endpoint: connection.Connection,
+                      errors: tp.List[BaseException], ring: tp.Optional[RingBuffer]) -> None:
+        try:
+            for batch in batches(rows, self.batch_size):
+                if ring is None:
+                    endpoint.send(batch)
+                else:
+                    ring.send(endpoint, encode_batch(batch))
+        except (BrokenPipeError, EOFError, OSError):
+            # worker was terminated, as result is not needed anymore
+            return
+        except BaseException as e:
+            errors.append(e)
+        try:
+            if ring is None:
+                endpoint.send(None)
+            else:
+                ring.send_end(endpoint)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def required_columns(self, downstream_columns: ops.TColumns) -> ops.TColumns:
+        for operation in reversed(self.operations):
+            downstream_columns = operation.required_columns(downstream_columns)
+        return downstream_columns
+
+
+def _remove_prefetch_after_filter(operations: tp.List[tp.Any], semi_join_filter: ops.BloomSemiJoinFilter) -> None:
+    """Prefetch requests rows at once, so it must not pull rows through semi-join filter before join builds it"""
+    for position, operation in enumerate(operations):
+        if isinstance(operation, ops.Map) and operation.mapper is semi_join_filter:
+            operations[position + 1:] = [operation for operation in operations[position + 1:]
+                                         if not isinstance(operation, Prefetch)]
+            return
+
+
+def split_into_stages(graph: 'Graph') -> 'Graph':
+    """
+    Construct copy of graph with operations split into pipeline stages
+    :param graph: graph to transform
+    """
+    operations: tp.List[tp.Any] = [Prefetch()]
+    maps: tp.List[ops.Map] = []
+    for operation in graph.operations_lst + [None]:
+        if isinstance(operation, ops.Map) and operation.mapper.process_safe:
+            maps.append(operation)
+            continue
+
+        if maps:
+            operations.append(ProcessMap(maps))
+            maps = []
+
+        if isinstance(operation, tuple):
+            join, join_graph = operation
+            if join.semi_join_filter is not None:
+                _remove_prefetch_after_filter(operations, join.semi_join_filter)
+            operations.append((join, split_into_stages(join_graph)))
+        elif operation is not None:
+            operations.append(operation)
+            if isinstance(operation, ExternalSort):
+                operations.append(Prefetch())
+
+    output_graph = graph.copy()
+    output_graph.operations_lst = operations
+    return output_graph
@@ -0,0 +1,99 @@
+import typing as tp
+import weakref
+
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+
+from . import operations as ops
+
+QUEUE_TIMEOUT = 0.1  # in seconds, how often producer checks whether consumer is gone
+
+
+class _End:
+    """Marker of the end of rows"""
+
+
+class _Error:
+    """Exception raised by upstream, which is re-raised in consumer thread"""
+
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+class Prefetch(ops.Operation):
+    """
+    Compute upstream rows in a background thread, passing them by batches through a bounded queue.
+    Computation starts as soon as the operation is called, not when the first row is requested, so several
+    prefetched inputs (e.g. both sides of join with their sort workers) are prepared concurrently.
+    """
+
+    def __init__(self, queue_size: int = 16, batch_size: int = 256) -> None:
+        """
+        :param queue_size: maximum amount of batches computed ahead
+        :param batch_size: amount of rows passed through queue at once
+        """
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        queue: 'Queue[tp.Any]' = Queue(self.queue_size)
+        stop_event = Event()
+        thread = Thread(target=self._produce, args=(rows, queue, stop_event), daemon=True)
+        thread.start()
+
+        generator = self._consume(queue, stop_event, thread)
+        # consumer generator may be dropped without being started, then its finally block is never executed
+        weakref.finalize(generator, stop_event.set)
+        return generator
+
+    def _produce(self, rows: ops.TRowsIterable, queue: 'Queue[tp.Any]', stop_event: Event) -> None:
+        def put(item: tp.Any) -> bool:
+            while not stop_event.is_set():
+                try:
+                    queue.put(item, timeout=QUEUE_TIMEOUT)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        rows_iterator = iter(rows)
+        try:
+            batch: tp.List[ops.TRow] = []
+            for row in rows_iterator:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(_End())
+        except BaseException as e:
+            put(_Error(e))
+        finally:
+            close = getattr(rows_iterator, "close", None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _consume(queue: 'Queue[tp.Any]', stop_event: Event, thread: Thread) -> ops.TRowsGenerator:
+        try:
+            while True:
+                item = queue.get()
+                if isinstance(item, _End):
+                    break
+                if isinstance(item, _Error):
+                    raise item.exception
+                yield from item
+        finally:
+            stop_event.set()
+            # unblock producer waiting on full queue
+            try:
+                while True:
+                    queue.get_nowait()
+            except Empty:
+                pass
+            thread.join()
+
+    def required_columns(self, downstream_columns: ops.TColumns) -> ops.TColumns:
+        return downstream_columns
@@ -0,0 +1,272 @@
+"""
+On-disk cache of graph results keyed by plan fingerprint and identity of input files.
+
+Fingerprint of graph is a hash of its description: source (file name or iterator name) and every operation
+with class name and attributes, recursively; functions are described by their code, defaults and closures,
+so that graphs constructed by the same code with the same parameters get the same fingerprint in any process.
+Attributes holding run-time state are listed by classes in _transient_attributes and are not described.
+Outputs of intermediate stages are saved with state of objects which later operations share with earlier ones,
+if these objects can save it (have checkpoint_state and restore_state methods), and are not saved otherwise.
+Identity of input file is its absolute path, size and modification time; graphs reading from iterators have no
+input identity and are never cached.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import types
+import typing as tp
+
+from . import operations as ops
+from .serialization import encode_batch, read_rows
+from .sinks import batches
+
+if tp.TYPE_CHECKING:
+    from .graph import Graph  # noqa
+
+CACHE_BATCH_SIZE = 1024
+
+
+def _describe_code(code: types.CodeType) -> tp.Any:
+    return ("code", code.co_code, tuple(_describe_code(const) if isinstance(const, types.CodeType) else repr(const)
+                                        for const in code.co_consts), code.co_names)
+
+
+def describe(value: tp.Any, visited: tp.Optional[tp.Set[int]] = None,
+             stateful: tp.Optional[tp.Dict[int, tp.Any]] = None) -> tp.Any:
+    """
+    Construct description of value from primitive values, stable between processes
+    :param value: operation, graph or any value of their attributes
+    :param visited: ids of objects being described, to break reference cycles
+    :param stateful: if passed, described objects having transient attributes are added to it by ids
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return value
+    if visited is None:
+        visited = set()
+    if id(value) in visited:
+        return ("cycle", type(value).__qualname__)
+    visited = visited | {id(value)}
+
+    if isinstance(value, (list, tuple)):
+        return tuple(describe(item, visited, stateful) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(repr(describe(item, visited, stateful)) for item in value)))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((repr(key), describe(item, visited, stateful)) for key, item in value.items())))
+    if isinstance(value, types.FunctionType):
+        closure = tuple(describe(cell.cell_contents, visited, stateful) for cell in value.__closure__ or ())
+        return ("function", value.__module__, value.__qualname__, _describe_code(value.__code__),
+                describe(value.__defaults__, visited, stateful), closure)
+    if isinstance(value, types.MethodType):
+        return ("method", value.__func__.__qualname__, describe(value.__self__, visited, stateful))
+    if isinstance(value, (types.BuiltinFunctionType, type)):
+        return ("callable", getattr(value, "__module__", None), value.__qualname__)
+
+    attributes: tp.Dict[str, tp.Any] = {}
+    for cls in type(value).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if hasattr(value, slot):
+                attributes[slot] = getattr(value, slot)
+    attributes.update(getattr(value, "__dict__", {}))
+    if not attributes:
+        # objects without attributes (e.g. itemgetter) describe themselves in repr
+        return ("object", type(value).__qualname__, repr(value) if type(value).__repr__ is not object.__repr__ else "")
+
+    transient = set()
+    for cls in type(value).__mro__:
+        transient.update(getattr(cls, "_transient_attributes", ()))
+    if transient and stateful is not None:
+        stateful[id(value)] = value
+    return ("object", type(value).__module__, type(value).__qualname__,
+            tuple(sorted((name, describe(item, visited, stateful))
+                         for name, item in attributes.items() if name not in transient)))
+
+
+def input_files(graph: 'Graph') -> tp.Optional[tp.List[str]]:
+    """
+    Files graph reads, including graphs joined with it
+    :return: None if some of graphs reads from iterator
+    """
+    if getattr(graph, "input_type", None) != "file":
+        return None
+    files = [os.path.abspath(graph.file_name)]  # type: ignore
+    for operation in graph.operations_lst:
+        if isinstance(operation, tuple):
+            join_files = input_files(operation[1])
+            if join_files is None:
+                return None
+            files.extend(join_files)
+    return files
+
+
+def fingerprint(graph: 'Graph', operations_amount: tp.Optional[int] = None) -> tp.Optional[str]:
+    """
+    Fingerprint of graph plan and its inputs
+    :param graph: graph
+    :param operations_amount: if passed, fingerprint of the first operations_amount operations of graph
+    :return: hex digest, None if graph reads from iterator
+    """
+    files = input_files(graph)
+    if files is None:
+        return None
+    operations = graph.operations_lst if operations_amount is None else graph.operations_lst[:operations_amount]
+    for operation in operations:
+        if isinstance(operation, tuple) and input_files(operation[1]) is None:
+            return None
+
+    identities = []
+    for filename in files:
+        stat = os.stat(filename)
+        identities.append((filename, stat.st_size, stat.st_mtime_ns))
+    description = (describe(graph.parser), describe(operations), identities)  # type: ignore
+    return hashlib.sha256(repr(description).encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def stateful_objects(operations: tp.Sequence[tp.Any]) -> tp.Dict[int, tp.Any]:
+    """Objects holding run-time state (having transient attributes) referenced by operations, by ids"""
+    state: tp.Dict[int, tp.Any] = {}
+    describe(operations, stateful=state)
+    return state
+
+
+def shared_state(graph: 'Graph', operations_amount: int,
+                 outer_state: tp.Optional[tp.Dict[int, tp.Any]] = None) -> tp.Optional[tp.List[tp.Any]]:
+    """
+    Objects holding run-time state which the first operations_amount operations of graph share with the rest
+    of operations (e.g. dictionary of encoded strings filled by mapper and used to decode them back); their state
+    must be saved with output of these operations for execution to start from it
+    :param outer_state: stateful objects of graph this graph is joined to
+    :return: None if state of some of objects cannot be saved
+    """
+    prefix_state = stateful_objects(graph.operations_lst[:operations_amount])
+    suffix_state = stateful_objects(graph.operations_lst[operations_amount:])
+    if outer_state:
+        suffix_state.update(outer_state)
+    shared = [value for object_id, value in prefix_state.items() if object_id in suffix_state]
+    if not all(hasattr(value, "checkpoint_state") and hasattr(value, "restore_state") for value in shared):
+        return None
+    return shared
+
+
+class ResultCache:
+    """
+    Directory of cached graph results bounded by total size; least recently used results are evicted first.
+    Rows of every result are saved in key.bin file, state of objects saved with them in key.state file
+    """
+
+    def __init__(self, directory: str, max_bytes: tp.Optional[int] = 1024 ** 3, cache_stages: bool = False,
+                 compress: bool = False) -> None:
+        """
+        :param directory: cache directory, created if absent
+        :param max_bytes: maximum total size of cached results, None for unbounded
+        :param cache_stages: cache outputs of intermediate stages (sorts and reduces) as well, so that graphs
+            sharing a prefix of operations with cached one start from its latest cached stage
+        :param compress: compress saved rows, see serialization module
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache_stages = cache_stages
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, extension: str = ".bin") -> str:
+        return os.path.join(self.directory, key + extension)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str, shared: tp.Sequence[tp.Any] = ()) -> tp.Optional[ops.TRowsGenerator]:
+        """
+        Cached rows
+        :param key: fingerprint
+        :param shared: objects to restore state saved with rows into, see shared_state
+        :return: None on miss, or if saved state cannot be restored
+        """
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        if shared:
+            try:
+                with open(self._path(key, ".state"), "rb") as state_file:
+                    states = pickle.load(state_file)
+            except FileNotFoundError:
+                f.close()
+                return None
+            if len(states) != len(shared) or not all(value.restore_state(state)
+                                                     for value, state in zip(shared, states)):
+                f.close()
+                return None
+        # access time is not updated on many file systems, so modification time marks recent use
+        os.utime(path)
+        return self._read(f)
+
+    @staticmethod
+    def _read(f: tp.IO[bytes]) -> ops.TRowsGenerator:
+        with f:
+            yield from read_rows(f)
+
+    def _write_temp(self) -> tp.Tuple[tp.IO[bytes], str]:
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        return os.fdopen(descriptor, "wb"), temp_path
+
+    def store(self, key: str, rows: ops.TRowsIterable, shared: tp.Sequence[tp.Any] = ()) -> ops.TRowsGenerator:
+        """
+        Pass rows through, saving them; result is cached only if all rows were consumed
+        :param key: fingerprint
+        :param rows: table rows
+        :param shared: objects to save state of when all rows are consumed, see shared_state
+        """
+        temp_paths = []
+        try:
+            f, temp_path = self._write_temp()
+            temp_paths.append(temp_path)
+            with f:
+                for batch in batches(rows, CACHE_BATCH_SIZE):
+                    f.write(encode_batch(batch, self.compress))
+                    yield from batch
+            if shared:
+                state_file, state_path = self._write_temp()
+                temp_paths.append(state_path)
+                with state_file:
+                    pickle.dump([value.checkpoint_state() for value in shared], state_file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(state_path, self._path(key, ".state"))
+            os.replace(temp_path, self._path(key))
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._evict()
+
+    def _remove(self, key: str) -> None:
+        for extension in (".bin", ".state"):
+            try:
+                os.remove(self._path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name[:-len(".bin")]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                self._remove(name[:-len(".bin")])
@@ -0,0 +1,108 @@
+"""
+Transfer of byte messages between processes through shared memory instead of pipe, which copies every byte
+through the kernel twice. Messages (serialized row batches) are copied into slots of shared memory ring,
+only small control messages with slot numbers are sent through pipe.
+"""
+import pickle
+import struct
+import typing as tp
+
+from multiprocessing import Semaphore, connection, shared_memory
+
+SLOTS = 4
+SLOT_SIZE = 1024 ** 2
+WAIT_TIMEOUT = 0.1  # seconds between checks whether reader is gone while writer waits for free slot
+
+_SLOT = b"s"  # followed by slot number and message length
+_INLINE = b"i"  # followed by message itself, for messages larger than slot
+_ERROR = b"e"  # followed by pickled exception of writer
+_SLOT_MESSAGE = struct.Struct("<II")
+
+
+class RingBuffer:
+    """
+    One-way channel of byte messages from writer process to reader process. Slots are used in round-robin order
+    and released by reader in the same order; semaphore counts free slots, so writer blocks when reader lags
+    behind by all slots. Ring must be created before worker process is started (it is inherited by worker)
+    and used by single writer and single reader; creator closes it when both are done.
+    """
+
+    def __init__(self, slots: int = SLOTS, slot_size: int = SLOT_SIZE) -> None:
+        """
+        :param slots: amount of messages which can be written ahead of reader
+        :param slot_size: maximum size of message passed through shared memory, larger ones are sent through pipe
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._free_slots = Semaphore(slots)
+        self._next_slot = 0  # of writer
+        self._view: tp.Optional[memoryview] = None  # of reader, message returned by the last recv
+        self._slot_taken = False
+
+    def send(self, endpoint: connection.Connection, data: bytes) -> None:
+        """
+        Write message
+        :param endpoint: pipe end of writer
+        :param data: message
+        :raise BrokenPipeError: if endpoint is closed while writer waits for free slot
+        """
+        if len(data) > self.slot_size:
+            endpoint.send_bytes(_INLINE + data)
+            return
+        while not self._free_slots.acquire(timeout=WAIT_TIMEOUT):
+            if endpoint.closed:
+                raise BrokenPipeError("ring buffer reader is gone")
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.slots
+        offset = slot * self.slot_size
+        self._memory.buf[offset:offset + len(data)] = data
+        endpoint.send_bytes(_SLOT + _SLOT_MESSAGE.pack(slot, len(data)))
+
+    def send_error(self, endpoint: connection.Connection, error: BaseException) -> None:
+        """Pass exception to reader, which raises it from recv"""
+        endpoint.send_bytes(_ERROR + pickle.dumps(error))
+
+    @staticmethod
+    def send_end(endpoint: connection.Connection) -> None:
+        """Mark the end of messages"""
+        endpoint.send_bytes(b"")
+
+    def _release(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._slot_taken:
+            self._slot_taken = False
+            self._free_slots.release()
+
+    def recv(self, endpoint: connection.Connection) -> tp.Optional[memoryview]:
+        """
+        Read message; it is valid only until the next call, as its slot is reused afterwards
+        :param endpoint: pipe end of reader
+        :return: None at the end of messages
+        """
+        self._release()
+        control = endpoint.recv_bytes()
+        if not control:
+            return None
+        tag = control[:1]
+        if tag == _SLOT:
+            slot, length = _SLOT_MESSAGE.unpack_from(control, 1)
+            offset = slot * self.slot_size
+            self._slot_taken = True
+            self._view = self._memory.buf[offset:offset + length]
+            return self._view
+        if tag == _INLINE:
+            return memoryview(control)[1:]
+        if tag == _ERROR:
+            raise pickle.loads(control[1:])
+        raise ValueError(f"unknown ring buffer message {tag!r}")
+
+    def close(self) -> None:
+        """Free shared memory; called by creator of ring when writer and reader are done"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        self._memory.close()
+        self._memory.unlink()
@@ -0,0 +1,298 @@
+"""
+Compact binary serialization of row batches, used for spill files, sort worker pipes, cached results and BinarySink.
+
+Rows of batch are grouped by schema (tuple of column names in order), names are written once per batch and values
+are packed by columns:
+ - int columns fitting in 64 bits: array of the smallest signed integers holding all values;
+ - float columns: array of doubles;
+ - bool columns: byte per value;
+ - str columns: UTF-8 text of strings separated by zero characters, or preceded by array of their lengths
+   if some of strings has zero character; columns with many repeated strings are written as array of indices
+   in list of distinct strings;
+ - columns of other or mixed types: pickled list of values.
+Batch payload is optionally compressed with zlib. Every batch is framed with its length and flags, so batches
+can be written to a file one after another and read back in a stream.
+"""
+import pickle
+import struct
+import sys
+import typing as tp
+import zlib
+
+from array import array
+from functools import lru_cache
+from itertools import accumulate, islice
+
+TRow = tp.Dict[str, tp.Any]
+
+BATCH_SIZE = 1024
+COMPRESSION_LEVEL = 1  # compression is used for files read many times, so it is tuned for speed
+
+FRAME = struct.Struct("<IB")
+_COMPRESSED = 1
+
+_INT = 1  # followed by typecode of array
+_FLOAT = 2
+_BOOL = 3
+_STR = 4  # strings separated by zero characters
+_STR_LENGTHS = 5  # typecode and array of string lengths followed by strings, if some of them has zero character
+_STR_DICTIONARY = 6  # typecode and array of indices in distinct strings, followed by them as _STR column
+_PICKLED = 7
+
+_COLUMN = struct.Struct("<BQ")
+_SWAP_BYTES = sys.byteorder == "big"  # arrays are written in little-endian byte order
+# signed typecodes by their size in bytes
+_INT_TYPECODES = [(-2 ** 7, 2 ** 7, "b"), (-2 ** 15, 2 ** 15, "h"), (-2 ** 31, 2 ** 31, "i"), (-2 ** 63, 2 ** 63, "q")]
+
+
+def _array_bytes(values: array) -> bytes:
+    if _SWAP_BYTES:
+        values.byteswap()
+    return values.typecode.encode() + values.tobytes()
+
+
+def _array(data: tp.Union[bytes, memoryview]) -> array:
+    values = array(chr(data[0]))
+    values.frombytes(data[1:])
+    if _SWAP_BYTES:
+        values.byteswap()
+    return values
+
+
+def _int_array(values: tp.Sequence[int]) -> array:
+    """Array of the smallest item size holding values
+    :raise OverflowError: if values do not fit in 64 bits"""
+    low, high = min(values), max(values)
+    for min_value, max_value, typecode in _INT_TYPECODES:
+        if min_value <= low and high < max_value:
+            return array(typecode, values)
+    raise OverflowError("int column does not fit in 64 bits")
+
+
+def _encode_column(values: tp.Sequence[tp.Any]) -> tp.Tuple[int, tp.List[bytes]]:
+    types = set(map(type, values))
+    if types == {str}:
+        distinct = set(values)
+        if len(distinct) * 2 <= len(values):
+            strings = list(distinct)
+            indices = _int_array(list(map({string: index for index, string in enumerate(strings)}.__getitem__,
+                                          values)))
+            strings_tag, strings_data = _encode_column(strings)
+            data = _array_bytes(indices)
+            return _STR_DICTIONARY, [_COLUMN.pack(0, len(data)), data,
+                                     _COLUMN.pack(strings_tag, sum(map(len, strings_data)))] + strings_data
+        text = "\0".join(values)
+        if text.count("\0") == len(values) - 1:
+            return _STR, [text.encode("utf-8", "surrogatepass")]
+        data = _array_bytes(_int_array(list(map(len, values))))
+        return _STR_LENGTHS, [_COLUMN.pack(0, len(data)), data, "".join(values).encode("utf-8", "surrogatepass")]
+    if types == {int}:
+        try:
+            return _INT, [_array_bytes(_int_array(values))]
+        except OverflowError:
+            pass
+    elif types == {float}:
+        return _FLOAT, [_array_bytes(array("d", values))]
+    elif types == {bool}:
+        return _BOOL, [bytes(values)]
+    return _PICKLED, [pickle.dumps(list(values), protocol=pickle.HIGHEST_PROTOCOL)]
+
+
+def _decode_column(tag: int, data: memoryview) -> tp.List[tp.Any]:
+    if tag == _STR:
+        return str(data, "utf-8", "surrogatepass").split("\0")
+    if tag in (_INT, _FLOAT):
+        return _array(data).tolist()
+    if tag == _BOOL:
+        return list(map(bool, data))
+    if tag in (_STR_LENGTHS, _STR_DICTIONARY):
+        _, size = _COLUMN.unpack_from(data)
+        values = _array(data[_COLUMN.size:_COLUMN.size + size])
+        rest = data[_COLUMN.size + size:]
+        if tag == _STR_DICTIONARY:
+            strings_tag, strings_size = _COLUMN.unpack_from(rest)
+            strings = _decode_column(strings_tag, rest[_COLUMN.size:_COLUMN.size + strings_size])
+            return list(map(strings.__getitem__, values))
+        text = str(rest, "utf-8", "surrogatepass")
+        offsets = [0]
+        offsets.extend(accumulate(values))
+        return [text[start:end] for start, end in zip(offsets, islice(offsets, 1, None))]
+    if tag == _PICKLED:
+        pickled: tp.List[tp.Any] = pickle.loads(data)
+        return pickled
+    raise ValueError(f"unknown column type {tag}")
+
+
+def _pack_strings(strings: tp.Sequence[str]) -> bytes:
+    encoded = [string.encode("utf-8", "surrogatepass") for string in strings]
+    return struct.pack(f"<I{len(encoded)}I", len(encoded), *map(len, encoded)) + b"".join(encoded)
+
+
+def _unpack_strings(data: memoryview, offset: int) -> tp.Tuple[tp.List[str], int]:
+    amount, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    lengths = struct.unpack_from(f"<{amount}I", data, offset)
+    offset += 4 * amount
+    strings = []
+    for length in lengths:
+        strings.append(str(data[offset:offset + length], "utf-8", "surrogatepass"))
+        offset += length
+    return strings, offset
+
+
+def encode_batch(rows: tp.Sequence[TRow], compress: bool = False) -> bytes:
+    """
+    Serialize rows into framed batch
+    :param rows: table rows
+    :param compress: compress batch with zlib
+    """
+    schemas = list(map(tuple, rows))
+    single_schema = not schemas or schemas.count(schemas[0]) == len(schemas)
+    distinct_schemas = dict.fromkeys(schemas[:1] if single_schema else schemas)
+    schema_ids = {schema: index for index, schema in enumerate(distinct_schemas)}
+
+    parts = [struct.pack("<II", len(rows), len(schema_ids))]
+    for schema in schema_ids:
+        parts.append(_pack_strings(schema))
+
+    if single_schema:
+        groups = [rows]
+    else:
+        data = _array_bytes(_int_array(list(map(schema_ids.__getitem__, schemas))))
+        parts.append(_COLUMN.pack(0, len(data)))
+        parts.append(data)
+        groups_by_schema: tp.List[tp.List[TRow]] = [[] for _ in schema_ids]
+        for row, schema in zip(rows, schemas):
+            groups_by_schema[schema_ids[schema]].append(row)
+        groups = groups_by_schema
+
+    for schema, group in zip(schema_ids, groups):
+        if not schema:
+            continue
+        for values in zip(*map(dict.values, group)):
+            tag, data = _encode_column(values)
+            parts.append(_COLUMN.pack(tag, sum(map(len, data))))
+            parts.extend(data)
+
+    payload = b"".join(parts)
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, COMPRESSION_LEVEL)
+        flags |= _COMPRESSED
+    return FRAME.pack(len(payload), flags) + payload
+
+
+@lru_cache(maxsize=256)
+def _row_constructor(schema: tp.Tuple[str, ...]) -> tp.Callable[[tp.Iterable[tp.Sequence[tp.Any]]], tp.List[TRow]]:
+    """
+    Construct function making rows of schema from tuples of their values. Dict displays are much faster than
+    dict(zip(schema, values)), so the function is generated for schema, as namedtuple does
+    """
+    if not schema:
+        return lambda values: [{} for _ in values]
+    names = [f"v{index}" for index in range(len(schema))]
+    items = ", ".join(f"schema[{index}]: {name}" for index, name in enumerate(names))
+    source = f"lambda values: [{{{items}}} for {', '.join(names)}, in values]"
+    constructor: tp.Callable[[tp.Iterable[tp.Sequence[tp.Any]]], tp.List[TRow]] = \
+        eval(source, {"schema": schema})
+    return constructor
+
+
+def decode_payload(payload: tp.Union[bytes, memoryview], flags: int) -> tp.List[TRow]:
+    """
+    Deserialize rows from batch payload
+    :param payload: batch without frame
+    :param flags: flags from frame
+    """
+    if flags & _COMPRESSED:
+        payload = zlib.decompress(payload)
+    data = memoryview(payload)
+    rows_amount, schemas_amount = struct.unpack_from("<II", data)
+    offset = 8
+    schemas = []
+    for _ in range(schemas_amount):
+        schema, offset = _unpack_strings(data, offset)
+        schemas.append(tuple(schema))
+
+    indices: tp.Optional[tp.List[int]] = None
+    if schemas_amount > 1:
+        _, size = _COLUMN.unpack_from(data, offset)
+        offset += _COLUMN.size
+        indices = _array(data[offset:offset + size]).tolist()
+        offset += size
+        amounts = [0] * schemas_amount
+        for index in indices:
+            amounts[index] += 1
+    else:
+        amounts = [rows_amount] * schemas_amount
+
+    groups = []
+    for schema, amount in zip(schemas, amounts):
+        columns = []
+        for _ in schema:
+            tag, size = _COLUMN.unpack_from(data, offset)
+            offset += _COLUMN.size
+            columns.append(_decode_column(tag, data[offset:offset + size]))
+            offset += size
+        groups.append(_row_constructor(schema)(zip(*columns) if schema else range(amount)))
+
+    if indices is None:
+        return groups[0] if groups else []
+    group_iterators = [iter(group) for group in groups]
+    return [next(group_iterators[index]) for index in indices]
+
+
+def decode_batch(data: bytes) -> tp.List[TRow]:
+    """
+    Deserialize rows from framed batch
+    :param data: result of encode_batch
+    """
+    length, flags = FRAME.unpack_from(data)
+    return decode_payload(memoryview(data)[FRAME.size:FRAME.size + length], flags)
+
+
+def write_rows(rows: tp.Iterable[TRow], file: tp.IO[bytes], batch_size: int = BATCH_SIZE,
+               compress: bool = False) -> int:
+    """
+    Append rows to binary file by batches
+    :param rows: table rows
+    :param file: binary file
+    :param batch_size: amount of rows serialized together
+    :param compress: compress batches with zlib
+    :return: amount of rows written
+    """
+    rows_amount = 0
+    rows_iterator = iter(rows)
+    while True:
+        batch = list(islice(rows_iterator, batch_size))
+        if not batch:
+            return rows_amount
+        file.write(encode_batch(batch, compress))
+        rows_amount += len(batch)
+
+
+def read_batches(file: tp.IO[bytes]) -> tp.Generator[tp.List[TRow], None, None]:
+    """
+    Read batches of rows written with write_rows from the current position to the end of file
+    :param file: binary file
+    """
+    while True:
+        frame = file.read(FRAME.size)
+        if not frame:
+            return
+        if len(frame) < FRAME.size:
+            raise ValueError("truncated batch frame")
+        length, flags = FRAME.unpack(frame)
+        payload = file.read(length)
+        if len(payload) < length:
+            raise ValueError("truncated batch")
+        yield decode_payload(payload, flags)
+
+
+def read_rows(file: tp.IO[bytes]) -> tp.Generator[TRow, None, None]:
+    """
+    Read rows written with write_rows from the current position to the end of file
+    :param file: binary file
+    """
+    for batch in read_batches(file):
+        yield from batch
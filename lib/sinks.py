@@ -0,0 +1,102 @@
+import json
+import typing as tp
+
+from abc import abstractmethod, ABC
+from itertools import islice
+
+from . import operations as ops
+from .serialization import read_rows, write_rows
+
+
+def batches(rows: ops.TRowsIterable, batch_size: int) -> tp.Generator[tp.List[ops.TRow], None, None]:
+    """
+    Split rows into lists of fixed size (last one may be shorter)
+    :param rows: table rows
+    :param batch_size: amount of rows in batch
+    """
+    rows_iterator = iter(rows)
+    while True:
+        batch = list(islice(rows_iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class Sink(ABC):
+    """Base class for sinks consuming graph output"""
+
+    @abstractmethod
+    def __call__(self, rows: ops.TRowsIterable) -> int:
+        """
+        Consume all rows
+        :param rows: table rows
+        :return: amount of rows consumed
+        """
+        pass
+
+
+class JsonLinesSink(Sink):
+    """Write rows to file as JSON objects, one per line"""
+
+    def __init__(self, filename: str, batch_size: int = 1024) -> None:
+        """
+        :param filename: file to write to
+        :param batch_size: amount of rows written by single write call
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+
+    def __call__(self, rows: ops.TRowsIterable) -> int:
+        rows_amount = 0
+        encoder = json.JSONEncoder()
+        with open(self.filename, "w") as f:
+            for batch in batches(rows, self.batch_size):
+                f.write("".join(encoder.encode(row) + "\n" for row in batch))
+                rows_amount += len(batch)
+        return rows_amount
+
+
+class BinarySink(Sink):
+    """Write rows to file in binary format, which can be read back with read_binary; see serialization module"""
+
+    def __init__(self, filename: str, batch_size: int = 1024, compress: bool = False) -> None:
+        """
+        :param filename: file to write to
+        :param batch_size: amount of rows serialized together
+        :param compress: compress batches with zlib, which makes file several times smaller
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.compress = compress
+
+    def __call__(self, rows: ops.TRowsIterable) -> int:
+        with open(self.filename, "wb") as f:
+            return write_rows(rows, f, self.batch_size, self.compress)
+
+
+def read_binary(filename: str) -> ops.TRowsGenerator:
+    """
+    Read rows written by BinarySink
+    :param filename: file to read from
+    """
+    with open(filename, "rb") as f:
+        yield from read_rows(f)
+
+
+class CallbackSink(Sink):
+    """Pass rows to callback by batches"""
+
+    def __init__(self, callback: tp.Callable[[tp.List[ops.TRow]], tp.Any], batch_size: int = 1024) -> None:
+        """
+        :param callback: function called with every batch of rows
+        :param batch_size: maximum amount of rows in batch
+        """
+        self.callback = callback
+        self.batch_size = batch_size
+
+    def __call__(self, rows: ops.TRowsIterable) -> int:
+        rows_amount = 0
+        for batch in batches(rows, self.batch_size):
+            self.callback(batch)
+            rows_amount += len(batch)
+        return rows_amount
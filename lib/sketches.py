@@ -0,0 +1,217 @@
+"""
+Probabilistic summaries of streams with bounded memory and configurable error, used by approximate reducers.
+Values are hashed by their order-preserving encoding (see sort_keys), so equal values of different types
+(e.g. 1 and 1.0) are counted as one value, and hashes do not depend on interpreter hash randomization.
+"""
+import heapq
+import math
+import typing as tp
+
+from hashlib import blake2b
+
+from .sort_keys import encode_value
+
+
+def hash64(value: tp.Any) -> int:
+    """
+    Stable 64-bit hash of value
+    :param value: hashed value
+    """
+    try:
+        data = encode_value(value)
+    except TypeError:
+        data = repr(value).encode("utf-8", "surrogatepass")
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Estimate of amount of distinct values. Small sets are counted exactly by hashes, which are converted into
+    2 ** precision byte registers when their amount grows, so that many small groups stay cheap
+    """
+
+    def __init__(self, error: float = 0.01) -> None:
+        """
+        :param error: relative standard error of estimate
+        """
+        self.precision = min(max(math.ceil(math.log2((1.04 / error) ** 2)), 4), 18)
+        self.registers: tp.Optional[bytearray] = None
+        self.hashes: tp.Set[int] = set()
+        self._sparse_limit = (1 << self.precision) // 16
+        self._rank_bits = 64 - self.precision
+        self._rank_mask = (1 << self._rank_bits) - 1
+
+    def _add_hash(self, hash_: int) -> None:
+        assert self.registers is not None
+        index = hash_ >> self._rank_bits
+        # position of the first 1 bit in the rest of hash
+        rank = self._rank_bits - (hash_ & self._rank_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _to_dense(self) -> None:
+        self.registers = bytearray(1 << self.precision)
+        for hash_ in self.hashes:
+            self._add_hash(hash_)
+        self.hashes = set()
+
+    def add(self, value: tp.Any) -> None:
+        if self.registers is not None:
+            self._add_hash(hash64(value))
+            return
+        self.hashes.add(hash64(value))
+        if len(self.hashes) > self._sparse_limit:
+            self._to_dense()
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """Add all values added to other sketch of the same precision"""
+        assert self.precision == other.precision
+        if other.registers is None:
+            for hash_ in other.hashes:
+                if self.registers is None:
+                    self.hashes.add(hash_)
+                else:
+                    self._add_hash(hash_)
+            if self.registers is None and len(self.hashes) > self._sparse_limit:
+                self._to_dense()
+            return
+        if self.registers is None:
+            self._to_dense()
+        assert self.registers is not None
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> float:
+        if self.registers is None:
+            return float(len(self.hashes))
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more precise for small amounts
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+class CountMinSketch:
+    """
+    Estimate of frequencies of values; estimate is never less than true frequency and exceeds it by at most
+    epsilon * total with probability 1 - delta
+    """
+
+    def __init__(self, epsilon: float = 0.001, delta: float = 0.01) -> None:
+        """
+        :param epsilon: error relative to total count
+        :param delta: probability of error exceeding epsilon * total
+        """
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.rows = [[0] * self.width for _ in range(self.depth)]
+        self.total = 0
+
+    def _indices(self, value: tp.Any) -> tp.List[int]:
+        # double hashing: i-th hash function is h1 + i * h2
+        hash_ = hash64(value)
+        first, second = hash_ & 0xffffffff, hash_ >> 32
+        return [(first + i * second) % self.width for i in range(self.depth)]
+
+    def add(self, value: tp.Any, count: int = 1) -> int:
+        """
+        Add occurrences of value
+        :return: new estimate of value frequency
+        """
+        self.total += count
+        estimate = None
+        for row, index in zip(self.rows, self._indices(value)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        assert estimate is not None
+        return estimate
+
+    def estimate(self, value: tp.Any) -> int:
+        return min(row[index] for row, index in zip(self.rows, self._indices(value)))
+
+
+class SpaceSaving:
+    """
+    Top-k frequent values kept in at most capacity counters. Counts are overestimated by at most total / capacity,
+    every value with frequency above total / capacity is guaranteed to be kept
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """
+        :param capacity: amount of counters
+        """
+        self.capacity = capacity
+        # value -> [count, overestimation]
+        self.counters: tp.Dict[tp.Any, tp.List[int]] = {}
+        # min-heap of (count, order, value), entries with outdated count are skipped
+        self._heap: tp.List[tp.Tuple[int, int, tp.Any]] = []
+        self._order = 0
+
+    def _push(self, value: tp.Any, count: int) -> None:
+        self._order += 1
+        heapq.heappush(self._heap, (count, self._order, value))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = []
+            for kept_value, counter in self.counters.items():
+                self._order += 1
+                self._heap.append((counter[0], self._order, kept_value))
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> tp.Tuple[tp.Any, int]:
+        while True:
+            count, _, value = heapq.heappop(self._heap)
+            counter = self.counters.get(value)
+            if counter is not None and counter[0] == count:
+                del self.counters[value]
+                return value, count
+
+    def add(self, value: tp.Any, count: int = 1) -> None:
+        counter = self.counters.get(value)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= self.capacity:
+                # new value replaces the least frequent one and inherits its count as possible overestimation
+                _, error = self._pop_min()
+            counter = self.counters[value] = [error, error]
+        counter[0] += count
+        self._push(value, counter[0])
+
+    def top(self, k: tp.Optional[int] = None) -> tp.List[tp.Tuple[tp.Any, int, int]]:
+        """
+        Most frequent values
+        :param k: amount of values, all kept values if not passed
+        :return: list of (value, count estimate, maximum overestimation) by count descending
+        """
+        items = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(value, count, error) for value, (count, error) in items[:k]]
+
+
+class BloomFilter:
+    """Set membership test without false negatives; false positives occur with probability error_rate"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        """
+        :param capacity: expected amount of added values
+        :param error_rate: probability of false positive when capacity values are added
+        """
+        capacity = max(capacity, 1)
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes_amount = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _indices(self, value: tp.Any) -> tp.Generator[int, None, None]:
+        # double hashing: i-th hash function is h1 + i * h2
+        hash_ = hash64(value)
+        first, second = hash_ & 0xffffffff, hash_ >> 32
+        for i in range(self.hashes_amount):
+            yield (first + i * second) % self.size
+
+    def add(self, value: tp.Any) -> None:
+        for index in self._indices(value):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, value: tp.Any) -> bool:
+        return all(self.bits[index >> 3] & (1 << (index & 7)) for index in self._indices(value))
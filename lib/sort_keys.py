@@ -0,0 +1,176 @@
+"""
+Order-preserving binary encoding of sort keys: bytes of encoded keys compare (as plain bytes) in the same order
+as tuples of key values compare in Python, so sorts, merges and joins compare single bytes objects in C instead
+of tuples of heterogeneous values.
+
+Every value is encoded with a type tag followed by payload:
+ - None;
+ - numbers (bool, int, float): order-preserving bits of nearest double followed by exact remainder of ints
+   which are not representable as double, so that equal numbers of different types get equal encodings;
+ - str (UTF-8) and bytes: zero bytes are escaped as 00 FF, the end is marked with 00 01, so that prefix of
+   a string is less than the string itself;
+ - tuples and lists: encoded elements followed by 00.
+Values of different types are ordered by tag: None < numbers < str < bytes < tuples, so mixed-type keys,
+which are not comparable in Python, can be sorted as well. Values of other types have no encoding, keys with
+them are compared as tuples of values.
+"""
+import struct
+import sys
+import typing as tp
+
+from operator import itemgetter
+
+from .groups import key_getter
+
+TRow = tp.Dict[str, tp.Any]
+
+_NONE = b"\x01"
+_NUMBER = b"\x02"
+_STR = b"\x03"
+_BYTES = b"\x04"
+_TUPLE = b"\x05"
+_TUPLE_END = b"\x00"
+_STRING_END = b"\x00\x01"
+
+_ZERO_REMAINDER = b"\x80"
+_ZERO = _NUMBER + b"\x80" + bytes(7) + _ZERO_REMAINDER
+_DOUBLE = struct.Struct(">d")
+_INVERTED_BYTES = bytes(range(255, -1, -1))
+_SIGN_FLIPPED_BYTES = [bytes((byte ^ 0x80,)) for byte in range(256)]
+_MAX_DOUBLE_INT = int(sys.float_info.max)
+_EXACT_INT_LIMIT = 2 ** 53  # ints not exceeding it by absolute value are exactly representable as double
+
+
+def _encode_double(value: float) -> bytes:
+    """Order-preserving bits of double: sign bit is flipped for non-negative values, all bits for negative ones"""
+    packed = _DOUBLE.pack(value)
+    if value < 0:
+        return packed.translate(_INVERTED_BYTES)
+    return _SIGN_FLIPPED_BYTES[packed[0]] + packed[1:]
+
+
+def _encode_remainder(remainder: int) -> bytes:
+    if remainder == 0:
+        return _ZERO_REMAINDER
+    magnitude = abs(remainder)
+    length = (magnitude.bit_length() + 7) // 8
+    if remainder > 0:
+        return bytes((0x81, length)) + magnitude.to_bytes(length, "big")
+    # larger magnitude of negative remainder must give smaller bytes
+    return bytes((0x7f, 255 - length)) + (magnitude ^ ((1 << (8 * length)) - 1)).to_bytes(length, "big")
+
+
+def _encode_float(value: float) -> bytes:
+    # integral floats which are not exact as ints are large enough to be integers themselves, so zero remainder
+    # makes them equal to ints with the same value; -0.0 is equal to 0.0
+    if value == 0:
+        return _ZERO
+    return _NUMBER + _encode_double(value) + _ZERO_REMAINDER
+
+
+def _encode_int(value: int) -> bytes:
+    if -_EXACT_INT_LIMIT <= value <= _EXACT_INT_LIMIT:
+        return _encode_float(value)
+    # clamp to the largest finite double, so that all huge ints stay less than infinity
+    nearest = max(min(value, _MAX_DOUBLE_INT), -_MAX_DOUBLE_INT)
+    approximation = float(nearest)
+    return _NUMBER + _encode_double(approximation) + _encode_remainder(value - int(approximation))
+
+
+def _encode_str(value: str) -> bytes:
+    return _STR + value.encode("utf-8", "surrogatepass").replace(b"\x00", b"\x00\xff") + _STRING_END
+
+
+def _encode_bytes(value: bytes) -> bytes:
+    return _BYTES + value.replace(b"\x00", b"\x00\xff") + _STRING_END
+
+
+def _encode_none(value: None) -> bytes:
+    return _NONE
+
+
+def _encode_tuple(value: tp.Sequence[tp.Any]) -> bytes:
+    return _TUPLE + encode_key(value) + _TUPLE_END
+
+
+_ENCODERS: tp.Dict[type, tp.Callable[[tp.Any], bytes]] = {
+    str: _encode_str,
+    int: _encode_int,
+    float: _encode_float,
+    bool: _encode_int,
+    type(None): _encode_none,
+    bytes: _encode_bytes,
+    tuple: _encode_tuple,
+    list: _encode_tuple,
+}
+
+
+def encode_value(value: tp.Any) -> bytes:
+    """
+    Encode single value
+    :param value: value of supported type
+    :raise TypeError: if value has no encoding
+    """
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        raise TypeError(f"no order-preserving encoding for values of type {type(value).__name__}")
+    return encoder(value)
+
+
+def encode_key(values: tp.Sequence[tp.Any]) -> bytes:
+    """
+    Encode tuple of key values
+    :param values: key values
+    :raise TypeError: if some of values has no encoding
+    """
+    try:
+        return b"".join([_ENCODERS[type(value)](value) for value in values])
+    except KeyError:
+        # report unsupported type
+        for value in values:
+            encode_value(value)
+        raise
+
+
+def comparable_key(values: tp.Sequence[tp.Any]) -> tp.Any:
+    """
+    Encoded key values, or tuple of values themselves if some of them has no encoding
+    :param values: key values
+    """
+    try:
+        return encode_key(values)
+    except TypeError:
+        return tuple(values)
+
+
+def sort_key_getter(keys: tp.Sequence[str]) -> tp.Callable[[TRow], tp.Any]:
+    """
+    Construct function computing key of row for sorts and merges: value itself for single key, as scalars are
+    compared in C already, and encoded key values for several keys instead of tuples compared element by element.
+    If sort by these keys fails with TypeError (values of different types), use encoded_key_getter.
+    :param keys: names of key columns
+    """
+    if len(keys) == 1:
+        return key_getter(keys)
+    return encoded_key_getter(keys)
+
+
+def encoded_key_getter(keys: tp.Sequence[str]) -> tp.Callable[[TRow], tp.Any]:
+    """
+    Construct function computing encoded key values of row (or tuple of values if some of them has no encoding)
+    :param keys: names of key columns
+    """
+    if len(keys) == 1:
+        get_value = itemgetter(*keys)
+
+        def single_key(row: TRow) -> tp.Any:
+            return comparable_key((get_value(row),))
+
+        return single_key
+
+    get_values = key_getter(keys)
+
+    def multiple_keys(row: TRow) -> tp.Any:
+        return comparable_key(get_values(row))
+
+    return multiple_keys
@@ -0,0 +1,159 @@
+"""
+On-disk index of inverted_index_graph result, queryable by term without loading the whole file.
+
+File layout:
+ - blocks of postings, each is zlib-compressed pickled list of (term, [(doc_id, score), ...]) sorted by term;
+   postings of single term are never split between blocks;
+ - term dictionary: pickled dict with column names and sorted lists of the first term, offset and length
+   of every block. Dictionary is sparse (one entry per block), so it is small enough to be loaded on open;
+ - footer: dictionary offset and length, and magic bytes.
+Lookup is a binary search in dictionary, followed by decompression of single block and binary search in it.
+"""
+import mmap
+import pickle
+import struct
+import typing as tp
+import zlib
+
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import itemgetter
+
+from . import operations as ops
+from .external_sort import ExternalSort
+from .sinks import Sink
+
+MAGIC = b"CGTI"
+FOOTER = struct.Struct("<QQ4s")
+
+TPostings = tp.List[tp.Tuple[tp.Any, tp.Any]]
+
+
+class TermIndexSink(Sink):
+    """Write (term, document, score) rows into term index file, which can be queried with TermIndex"""
+
+    def __init__(self, filename: str, term_column: str = 'text', doc_column: str = 'doc_id',
+                 score_column: str = 'tf_idf', block_size: int = 256, compression_level: int = 6) -> None:
+        """
+        :param filename: file to write to
+        :param term_column: name of column with term
+        :param doc_column: name of column with document id
+        :param score_column: name of column with score of document for term
+        :param block_size: minimum amount of postings in compressed block (except the last one)
+        :param compression_level: zlib compression level
+        """
+        self.filename = filename
+        self.term_column = term_column
+        self.doc_column = doc_column
+        self.score_column = score_column
+        self.block_size = block_size
+        self.compression_level = compression_level
+
+    def __call__(self, rows: ops.TRowsIterable) -> int:
+        rows_amount = 0
+        first_terms: tp.List[str] = []
+        offsets: tp.List[int] = []
+        lengths: tp.List[int] = []
+        block: tp.List[tp.Tuple[str, TPostings]] = []
+        block_postings = 0
+
+        with open(self.filename, "wb") as f:
+            def write_block() -> None:
+                data = zlib.compress(pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL), self.compression_level)
+                first_terms.append(block[0][0])
+                offsets.append(f.tell())
+                lengths.append(len(data))
+                f.write(data)
+
+            sorted_rows = ExternalSort([self.term_column])(rows)
+            for term, term_rows in groupby(sorted_rows, key=itemgetter(self.term_column)):
+                postings = [(row[self.doc_column], row[self.score_column]) for row in term_rows]
+                postings.sort(key=itemgetter(1), reverse=True)
+                block.append((term, postings))
+                block_postings += len(postings)
+                rows_amount += len(postings)
+                if block_postings >= self.block_size:
+                    write_block()
+                    block = []
+                    block_postings = 0
+            if block:
+                write_block()
+
+            dictionary = {
+                "columns": (self.term_column, self.doc_column, self.score_column),
+                "first_terms": first_terms,
+                "offsets": offsets,
+                "lengths": lengths,
+            }
+            dictionary_offset = f.tell()
+            data = pickle.dumps(dictionary, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(data)
+            f.write(FOOTER.pack(dictionary_offset, len(data), MAGIC))
+        return rows_amount
+
+
+class TermIndex:
+    """Read-only access to file written by TermIndexSink; file is memory-mapped, blocks are decompressed on demand"""
+
+    def __init__(self, filename: str) -> None:
+        """
+        :param filename: term index file
+        """
+        self._file = open(filename, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        dictionary_offset, dictionary_length, magic = FOOTER.unpack(self._mmap[-FOOTER.size:])
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a term index file")
+        dictionary = pickle.loads(self._mmap[dictionary_offset:dictionary_offset + dictionary_length])
+        self.term_column, self.doc_column, self.score_column = dictionary["columns"]
+        self._first_terms: tp.List[str] = dictionary["first_terms"]
+        self._offsets: tp.List[int] = dictionary["offsets"]
+        self._lengths: tp.List[int] = dictionary["lengths"]
+
+    def __enter__(self) -> 'TermIndex':
+        return self
+
+    def __exit__(self, *args: tp.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def _block(self, index: int) -> tp.List[tp.Tuple[str, TPostings]]:
+        offset = self._offsets[index]
+        block: tp.List[tp.Tuple[str, TPostings]] = pickle.loads(
+            zlib.decompress(self._mmap[offset:offset + self._lengths[index]]))
+        return block
+
+    def _postings(self, term: str) -> tp.Optional[TPostings]:
+        block_index = bisect_right(self._first_terms, term) - 1
+        if block_index < 0:
+            return None
+        block = self._block(block_index)
+        position = bisect_left([block_term for block_term, _ in block], term)
+        if position < len(block) and block[position][0] == term:
+            return block[position][1]
+        return None
+
+    def __contains__(self, term: str) -> bool:
+        return self._postings(term) is not None
+
+    def lookup(self, term: str, n: tp.Optional[int] = None) -> tp.List[ops.TRow]:
+        """
+        Documents of term ordered by score descending
+        :param term: term to look up
+        :param n: if passed, only n documents with largest score are returned
+        :return: rows in the format written to sink, empty list for unknown term
+        """
+        postings = self._postings(term) or []
+        return [{self.doc_column: doc_id, self.term_column: term, self.score_column: score}
+                for doc_id, score in postings[:n]]
+
+    def terms(self) -> tp.Generator[str, None, None]:
+        """Iterate over all terms in sorted order"""
+        for index in range(len(self._offsets)):
+            for term, _ in self._block(index):
+                yield term
@@ -1,8 +1,17 @@
+import io
+
+from itertools import islice
+from multiprocessing import Pipe
 from operator import itemgetter
 
+import pytest
 from pytest import approx
 
-from . import operations as ops
+from . import operations as ops, serialization, sort_keys
+from .external_sort import ExternalSort, SortTopN
+from .memory_budget import MemoryBudget
+from .prefetch import Prefetch
+from .ring_buffer import RingBuffer
 
 
 def test_dummy_map() -> None:
@@ -454,3 +463,335 @@ def test_simple_join_with_collision() -> None:
                       keys=['player_id'])(presorted_games, presorted_players)
 
     assert expected == sorted(result, key=itemgetter('game_id'))
+
+
+def test_join_by_multiple_keys() -> None:
+    scores: ops.TRowsIterable = [
+        {'season': 1, 'player_id': 1, 'score': 10},
+        {'season': 1, 'player_id': 2, 'score': 20},
+        {'season': 2, 'player_id': 1, 'score': 30}
+    ]
+
+    awards: ops.TRowsIterable = [
+        {'season': 1, 'player_id': 2, 'award': 'mvp'},
+        {'season': 2, 'player_id': 1, 'award': 'mvp'},
+        {'season': 2, 'player_id': 3, 'award': 'rookie'}
+    ]
+
+    expected: ops.TRowsIterable = [
+        {'season': 1, 'player_id': 2, 'score': 20, 'award': 'mvp'},
+        {'season': 2, 'player_id': 1, 'score': 30, 'award': 'mvp'}
+    ]
+
+    presorted_scores = sorted(scores, key=itemgetter('season', 'player_id'))  # !!!
+    presorted_awards = sorted(awards, key=itemgetter('season', 'player_id'))  # !!!
+    result = ops.Join(ops.InnerJoiner(), keys=['season', 'player_id'])(presorted_scores, presorted_awards)
+
+    assert expected == list(result)
+
+
+def test_limit() -> None:
+    closed = []
+
+    def rows() -> ops.TRowsGenerator:
+        try:
+            for i in range(100):
+                yield {'test_id': i}
+        finally:
+            closed.append(True)
+
+    expected: ops.TRowsIterable = [
+        {'test_id': 0},
+        {'test_id': 1},
+        {'test_id': 2}
+    ]
+
+    result = ops.Limit(3)(rows())
+
+    assert expected == list(result)
+    assert closed == [True]
+
+
+def test_sort_top_n() -> None:
+    matches: ops.TRowsIterable = [
+        {'match_id': 2, 'player_id': 5, 'rank': 15},
+        {'match_id': 1, 'player_id': 1, 'rank': 42},
+        {'match_id': 2, 'player_id': 6, 'rank': 39},
+        {'match_id': 1, 'player_id': 2, 'rank': 7},
+        {'match_id': 2, 'player_id': 7, 'rank': 27},
+        {'match_id': 1, 'player_id': 3, 'rank': 0},
+        {'match_id': 2, 'player_id': 8, 'rank': 7},
+        {'match_id': 1, 'player_id': 4, 'rank': 39},
+        {'match_id': 2, 'player_id': 9, 'rank': 27}
+    ]
+
+    expected_largest: ops.TRowsIterable = [
+        {'match_id': 1, 'player_id': 1, 'rank': 42},
+        {'match_id': 1, 'player_id': 4, 'rank': 39},
+
+        {'match_id': 2, 'player_id': 6, 'rank': 39},
+        {'match_id': 2, 'player_id': 7, 'rank': 27}
+    ]
+
+    expected_smallest: ops.TRowsIterable = [
+        {'match_id': 1, 'player_id': 3, 'rank': 0},
+        {'match_id': 1, 'player_id': 2, 'rank': 7},
+
+        {'match_id': 2, 'player_id': 8, 'rank': 7},
+        {'match_id': 2, 'player_id': 5, 'rank': 15}
+    ]
+
+    for in_memory in [True, False]:
+        result = SortTopN(['match_id'], column='rank', n=2, in_memory=in_memory)(matches)
+        assert expected_largest == list(result)
+
+        result = SortTopN(['match_id'], column='rank', n=2, ascending=False, in_memory=in_memory)(matches)
+        assert expected_smallest == list(result)
+
+
+def test_prefetch() -> None:
+    tests: ops.TRowsIterable = [{'test_id': i} for i in range(1000)]
+
+    assert tests == list(Prefetch(queue_size=2, batch_size=7)(tests))
+
+    def failing_rows() -> ops.TRowsGenerator:
+        yield {'test_id': 1}
+        raise ValueError('broken source')
+
+    result = Prefetch()(failing_rows())
+    with pytest.raises(ValueError, match='broken source'):
+        list(result)
+
+
+def test_external_sort_with_spilling() -> None:
+    tests: ops.TRowsIterable = [{'key': i * 7919 % 101, 'test_id': i} for i in range(20000)]
+
+    budget = MemoryBudget(limit=0)  # sort worker gets only minimal buffer, so it spills several runs
+    result = ExternalSort(['key'])(tests, budget=budget)
+
+    assert sorted(tests, key=itemgetter('key')) == list(result)
+    assert budget.acquire(1) == 0
+
+
+def test_join_with_spilling() -> None:
+    players: ops.TRowsIterable = [
+        {'player_id': 1, 'username': 'XeroX'},
+        {'player_id': 2, 'username': 'jay'}
+    ]
+
+    games: ops.TRowsIterable = [{'game_id': i, 'player_id': 1 + i % 2} for i in range(100)]
+
+    presorted_games = sorted(games, key=itemgetter('player_id'))  # !!!
+    expected = list(ops.Join(ops.InnerJoiner(), keys=['player_id'])(players, presorted_games))
+    result = ops.Join(ops.InnerJoiner(), keys=['player_id'])(players, presorted_games, budget=MemoryBudget(limit=0))
+
+    assert 100 == len(expected)
+    assert expected == list(result)
+
+
+def test_string_encoding() -> None:
+    data: ops.TRowsIterable = [
+        {'test_id': 1, 'text': 'world'},
+        {'test_id': 2, 'text': 'hello'},
+        {'test_id': 3, 'text': 'world'}
+    ]
+
+    dictionary = ops.StringDictionary()
+    encoded = list(ops.Map(ops.EncodeStrings('text', dictionary))(row.copy() for row in data))
+
+    assert [row['text'] for row in encoded] == [0, 1, 0]
+    assert len(dictionary) == 2
+    assert data == list(ops.Map(ops.DecodeStrings('text', dictionary))(encoded))
+
+
+def test_tokenize() -> None:
+    data: ops.TRowsIterable = [
+        {'test_id': 1, 'text': 'Hello, world! HELLO...', 'other': 'x'},
+        {'test_id': 2, 'text': ''}
+    ]
+
+    etalon: ops.TRowsIterable = [
+        {'test_id': 1, 'text': 'hello'},
+        {'test_id': 1, 'text': 'world'},
+        {'test_id': 1, 'text': 'hello'}
+    ]
+
+    result = ops.Map(ops.Tokenize('text', keep_columns=['test_id']))(row.copy() for row in data)
+    assert etalon == list(result)
+
+    etalon_counts: ops.TRowsIterable = [
+        {'text': 'hello', 'count': 2},
+        {'text': 'world', 'count': 1}
+    ]
+
+    result = ops.Map(ops.Tokenize('text', keep_columns=[], count_column='count'))(row.copy() for row in data)
+    assert etalon_counts == list(result)
+
+    mappers = [ops.Map(ops.FilterPunctuation('text')), ops.Map(ops.LowerCase('text')), ops.Map(ops.Split('text'))]
+    rows: ops.TRowsIterable = (row.copy() for row in data)
+    for mapper in mappers:
+        rows = mapper(rows)
+    assert list(rows) == list(ops.Map(ops.Tokenize('text'))(row.copy() for row in data))
+
+
+def test_sort_keys() -> None:
+    values = [None, float('-inf'), -2 ** 70 - 1, -2 ** 70, -1.5, -1, False, 0.0, 0.5, True, 2 ** 53, 2 ** 53 + 1,
+              float('inf'), '', 'a', 'a\x00', 'a\x00b', 'a\x01', 'ab', 'é', b'', b'a', (1, 'a'), (1, 'b'), (2,)]
+
+    encoded = [sort_keys.encode_value(value) for value in values]
+    assert encoded == sorted(encoded)
+    assert len(set(encoded)) == len(values) - 1  # False == 0.0
+    assert sort_keys.encode_value(1) == sort_keys.encode_value(1.0) == sort_keys.encode_value(True)
+    assert sort_keys.encode_key(('a', 1)) < sort_keys.encode_key(('a', 2)) < sort_keys.encode_key(('ab', 0))
+
+    with pytest.raises(TypeError):
+        sort_keys.encode_value(object())
+    assert sort_keys.comparable_key((1, ...)) == (1, ...)
+
+
+def test_external_sort_of_mixed_types() -> None:
+    data: ops.TRowsIterable = [
+        {'test_id': 1, 'key': 'b'},
+        {'test_id': 2, 'key': 2},
+        {'test_id': 3, 'key': None},
+        {'test_id': 4, 'key': 'a'},
+        {'test_id': 5, 'key': 1.5}
+    ]
+
+    etalon: ops.TRowsIterable = [
+        {'test_id': 3, 'key': None},
+        {'test_id': 5, 'key': 1.5},
+        {'test_id': 2, 'key': 2},
+        {'test_id': 4, 'key': 'a'},
+        {'test_id': 1, 'key': 'b'}
+    ]
+
+    assert etalon == list(ExternalSort(['key'])(data))
+
+    right: ops.TRowsIterable = [
+        {'key': 1.5, 'value': 'x'},
+        {'key': 'b', 'value': 'y'}
+    ]
+
+    etalon_join: ops.TRowsIterable = [
+        {'test_id': 5, 'key': 1.5, 'value': 'x'},
+        {'test_id': 1, 'key': 'b', 'value': 'y'}
+    ]
+
+    assert etalon_join == list(ops.Join(ops.InnerJoiner(), ['key'])(etalon, right))
+
+
+def test_approximate_reducers() -> None:
+    data: ops.TRowsIterable = [{'group': i % 2, 'value': i % 7 if i % 3 else 100} for i in range(3000)]
+
+    etalon_distinct: ops.TRowsIterable = [
+        {'group': 0, 'count_distinct': 8},
+        {'group': 1, 'count_distinct': 8}
+    ]
+
+    result = ops.Reduce(ops.ApproximateCountDistinct('value'), ['group'])(sorted(data, key=itemgetter('group')))
+    assert etalon_distinct == list(result)
+
+    large = [{'value': i} for i in range(100000)]
+    result = ops.Reduce(ops.ApproximateCountDistinct('value', 'distinct', error=0.01), [])(large)
+    assert list(result) == [{'distinct': approx(100000, rel=0.05)}]
+
+    result = list(ops.Reduce(ops.ApproximateTopK('value', 2), [])(data))
+    assert result == [{'value': 100, 'count': 1000}, {'value': result[1]['value'], 'count': approx(286, abs=2)}]
+
+    result = list(ops.Reduce(ops.HeavyHitters('value', 0.2), [])(data))
+    assert result == [{'value': 100, 'count': approx(1000, abs=3)}]
+
+
+def test_distinct() -> None:
+    data: ops.TRowsIterable = [
+        {'doc_id': 1, 'text': 'b', 'n': 1},
+        {'doc_id': 1, 'text': 'a', 'n': 2},
+        {'doc_id': 1, 'text': 'b', 'n': 3},
+        {'doc_id': 2, 'text': 'b', 'n': 4},
+        {'doc_id': 2, 'text': 'b', 'n': 5},
+        {'doc_id': 1, 'text': 'a', 'n': 6}
+    ]
+
+    etalon: ops.TRowsIterable = [
+        {'doc_id': 1, 'text': 'b', 'n': 1},
+        {'doc_id': 1, 'text': 'a', 'n': 2},
+        {'doc_id': 2, 'text': 'b', 'n': 4}
+    ]
+
+    assert etalon == list(ops.Distinct(['doc_id', 'text'])(data))
+    assert etalon + [data[-1]] == list(ops.Distinct(['doc_id', 'text'], grouped_by=['doc_id'])(data))
+
+    many = [{'key': i % 5000, 'n': i} for i in range(20000)]
+    budget = MemoryBudget(0)
+    result = list(ops.Distinct(['key'])(many, budget=budget))
+    assert sorted(result, key=itemgetter('key')) == many[:5000]
+    assert budget.acquire(1) == 0
+
+
+def test_join_with_semi_join_filter() -> None:
+    left: ops.TRowsIterable = [{'key': i, 'left': i * 10} for i in range(100)]
+    right: ops.TRowsIterable = [{'key': 3, 'right': 'a'}, {'key': 50, 'right': 'b'}]
+
+    semi_join_filter = ops.BloomSemiJoinFilter(['key'])
+    filtered_left = ops.Map(semi_join_filter)(left)
+
+    with pytest.raises(RuntimeError):
+        next(ops.Map(ops.BloomSemiJoinFilter(['key']))(left))
+
+    etalon: ops.TRowsIterable = [
+        {'key': 3, 'left': 30, 'right': 'a'},
+        {'key': 50, 'left': 500, 'right': 'b'}
+    ]
+
+    result = ops.Join(ops.InnerJoiner(), ['key'], semi_join_filter)(filtered_left, right)
+    assert etalon == list(result)
+    assert semi_join_filter.bloom_filter is not None
+    assert sum(row['key'] in semi_join_filter.bloom_filter for row in left) < 10
+
+
+def test_serialization() -> None:
+    batches = [
+        [],
+        [{}, {}],
+        [{'text': 'a\x00b', 'count': 2 ** 70}, {'text': '', 'count': -5}],
+        [{'word': 'é\ud800', 'flag': True, 'score': 0.5}] * 3 + [{'word': 'x', 'flag': False, 'score': -1.0}],
+        [{'doc_id': 1, 'text': 'a'}, {'text': 'b', 'doc_id': 2}, {'doc_id': None, 'tags': ('a', 1)}],
+        [{'doc_id': i, 'text': str(i % 7), 'tf': i / 3} for i in range(1000)],
+    ]
+    for rows in batches:
+        for compress in (False, True):
+            decoded = serialization.decode_batch(serialization.encode_batch(rows, compress))
+            assert decoded == rows
+            assert [list(row) for row in decoded] == [list(row) for row in rows]
+
+    file = io.BytesIO()
+    assert serialization.write_rows(batches[-1], file, batch_size=300, compress=True) == 1000
+    file.seek(0)
+    assert list(serialization.read_rows(file)) == batches[-1]
+
+
+def test_shared_memory_transfer() -> None:
+    tests: ops.TRowsIterable = [{'key': i * 7919 % 101, 'test_id': i, 'text': str(i) * (i % 50)} for i in range(20000)]
+    expected = sorted(tests, key=itemgetter('key'))
+    assert expected == list(ExternalSort(['key'])(tests, shared_memory=True))
+    assert expected == list(ExternalSort(['key'])(tests, budget=MemoryBudget(limit=0), shared_memory=True))
+
+    # results are consumed partially, worker is terminated
+    assert expected[:5] == list(islice(ExternalSort(['key'])(tests, shared_memory=True), 5))
+
+    ring = RingBuffer(slots=2, slot_size=16)
+    local_endpoint, remote_endpoint = Pipe()
+    messages = [b'short', b'message larger than slot', b'', b'x' * 16]
+    for message in messages[:2]:
+        ring.send(local_endpoint, message)
+    assert bytes(ring.recv(remote_endpoint)) == messages[0]  # type: ignore
+    for message in messages[2:]:
+        ring.send(local_endpoint, message)
+    ring.send_error(local_endpoint, ValueError('failed writer'))
+    ring.send_end(local_endpoint)
+    assert [bytes(ring.recv(remote_endpoint)) for _ in messages[1:]] == messages[1:]  # type: ignore
+    with pytest.raises(ValueError, match='failed writer'):
+        ring.recv(remote_endpoint)
+    assert ring.recv(remote_endpoint) is None
+    ring.close()
@@ -1,3 +1,5 @@
+import json
+import os
 import typing as tp
 
 from itertools import islice, cycle
@@ -6,7 +8,13 @@ from operator import itemgetter
 from pytest import approx
 
 from . import graphs
-from .lib import memory_watchdog
+from .incremental import IncrementalTextIndex
+from .lib import memory_watchdog, operations as ops, optimizer, result_cache
+from .lib.external_sort import ExternalSort
+from .lib.graph import Graph
+from .lib.result_cache import ResultCache
+from .lib.sinks import BinarySink, CallbackSink, JsonLinesSink, read_binary
+from .lib.term_index import TermIndex, TermIndexSink
 
 MiB = 1024 ** 2
 
@@ -104,6 +112,12 @@ def test_tf_idf() -> None:
 
     assert expected == sorted(result, key=itemgetter('doc_id', 'text'))
 
+    graph = graphs.inverted_index_graph('texts', doc_column='doc_id', text_column='text', result_column='tf_idf',
+                                        approximate=True)
+    result = graph.run(texts=lambda: iter(rows))
+
+    assert expected == sorted(result, key=itemgetter('doc_id', 'text'))
+
 
 def test_pmi() -> None:
     graph = graphs.pmi_graph('texts', doc_column='doc_id', text_column='text', result_column='pmi')
@@ -190,6 +204,249 @@ def test_yandex_maps() -> None:
     assert expected == sorted(result, key=itemgetter('weekday', 'hour'))
 
 
+def test_word_count_sinks(tmp_path: tp.Any) -> None:
+    graph = graphs.word_count_graph('docs', text_column='text', count_column='count')
+
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+
+    expected = graph.run(docs=lambda: iter(docs))
+
+    json_file = str(tmp_path / 'result.jsonl')
+    assert graph.run(sink=JsonLinesSink(json_file, batch_size=2), docs=lambda: iter(docs)) == len(expected)
+    with open(json_file) as f:
+        assert expected == [json.loads(line) for line in f]
+
+    binary_file = str(tmp_path / 'result.bin')
+    assert graph.run(sink=BinarySink(binary_file, batch_size=2), docs=lambda: iter(docs)) == len(expected)
+    assert expected == list(read_binary(binary_file))
+
+    batches: tp.List[tp.List[tp.Dict[str, tp.Any]]] = []
+    assert graph.run(sink=CallbackSink(batches.append, batch_size=2), docs=lambda: iter(docs)) == len(expected)
+    assert [2, 2, 1] == [len(batch) for batch in batches]
+    assert expected == [row for batch in batches for row in batch]
+
+
+def test_word_count_limit() -> None:
+    graph = graphs.word_count_graph('docs', text_column='text', count_column='count')
+
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+
+    expected = [
+        {'count': 1, 'text': 'hell'},
+        {'count': 1, 'text': 'world'},
+        {'count': 2, 'text': 'hello'}
+    ]
+
+    assert expected == graph.limit(3).run(docs=lambda: iter(docs))
+    assert expected[:2] == graph.limit(3).limit(2).run(docs=lambda: iter(docs))
+    assert expected[:1] == graph.map(graphs.operations.DummyMapper()).limit(1).run(docs=lambda: iter(docs))
+
+
+def test_optimizer() -> None:
+    graph = graphs.Graph.graph_from_iter('rows') \
+        .map(graphs.operations.Product(['a', 'b'], 'c')) \
+        .sort(['c']) \
+        .map(graphs.operations.Filter(lambda row: row['a'] > 1, ['a'])) \
+        .reduce(graphs.operations.Sum('a'), ['c'])
+
+    optimized_graph = optimizer.optimize(graph)
+    operations = [type(operation.mapper if isinstance(operation, graphs.operations.Map) else operation)
+                  for operation in optimized_graph.operations_lst]
+    assert [graphs.operations.Filter, graphs.operations.Product, graphs.operations.Project,
+            ExternalSort, graphs.operations.Reduce] == operations
+    assert ['a', 'c'] == optimized_graph.operations_lst[2].mapper.columns
+
+    rows = [
+        {'a': 1, 'b': 6, 'junk': 'x'},
+        {'a': 2, 'b': 3, 'junk': 'y'},
+        {'a': 3, 'b': 2, 'junk': 'z'},
+        {'a': 4, 'b': 1, 'junk': 'w'}
+    ]
+
+    expected = [
+        {'c': 4, 'a': 4},
+        {'c': 6, 'a': 5}
+    ]
+
+    assert expected == graph.run(rows=lambda: iter(rows))
+    assert expected == graph.run(rows=lambda: iter(rows), optimize=False)
+
+
+def test_bloom_filter_join() -> None:
+    graph = graphs.pmi_graph('texts')
+    operations = optimizer.optimize(graph).operations_lst
+
+    # semi-join filter is moved before the sort of the left table
+    filter_position = next(i for i, operation in enumerate(operations)
+                           if isinstance(operation, ops.Map) and isinstance(operation.mapper, ops.BloomSemiJoinFilter))
+    assert isinstance(operations[filter_position + 2], ExternalSort)
+    assert isinstance(operations[filter_position + 3], tuple)
+
+
+def test_pipelined_run() -> None:
+    rows = [
+        {'doc_id': 1, 'text': 'hello, little world'},
+        {'doc_id': 2, 'text': 'little'},
+        {'doc_id': 3, 'text': 'little little little'},
+        {'doc_id': 4, 'text': 'little? hello little world'},
+        {'doc_id': 5, 'text': 'HELLO HELLO! WORLD...'},
+        {'doc_id': 6, 'text': 'world? world... world!!! WORLD!!! HELLO!!! HELLO!!!!!!!'}
+    ]
+
+    for graph in [graphs.word_count_graph('texts'), graphs.inverted_index_graph('texts'), graphs.pmi_graph('texts')]:
+        expected = graph.run(texts=lambda: (row.copy() for row in rows))
+        assert expected == graph.run(texts=lambda: (row.copy() for row in rows), pipelined=True)
+        assert expected == graph.run(texts=lambda: (row.copy() for row in rows), pipelined=True, shared_memory=True)
+
+
+def test_word_count_memory_limit() -> None:
+    graph = graphs.word_count_graph('docs', text_column='text', count_column='count')
+
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+
+    assert graph.run(docs=lambda: iter(docs)) == graph.run(docs=lambda: iter(docs), memory_limit=48 * MiB)
+
+
+def test_incremental_text_index(tmp_path: tp.Any) -> None:
+    docs = [
+        {'doc_id': 1, 'text': 'hello, little world'},
+        {'doc_id': 2, 'text': 'little'},
+        {'doc_id': 3, 'text': 'little little little'},
+        {'doc_id': 4, 'text': 'little? hello little world'},
+        {'doc_id': 5, 'text': 'HELLO HELLO! WORLD...'},
+        {'doc_id': 6, 'text': 'world? world... world!!! WORLD!!! HELLO!!!'}
+    ]
+    word_count = graphs.word_count_graph('texts')
+    inverted_index = graphs.inverted_index_graph('texts')
+
+    index = IncrementalTextIndex(str(tmp_path / 'index.db'))
+    assert index.update(docs[:4]) == {'hello', 'little', 'world'}
+    index.close()
+
+    # state is persistent
+    index = IncrementalTextIndex(str(tmp_path / 'index.db'))
+    assert index.update(docs[4:], removed_doc_ids=[2]) == {'hello', 'little', 'world'}
+    assert index.update([{'doc_id': 3, 'text': 'Hello'}]) == {'hello', 'little'}
+
+    current_docs = [docs[0], docs[3], {'doc_id': 3, 'text': 'Hello'}, docs[4], docs[5]]
+    assert index.word_count() == word_count.run(texts=lambda: (row.copy() for row in current_docs))
+    assert index.word_count(['little']) == [{'text': 'little', 'count': 3}]
+
+    expected = inverted_index.run(texts=lambda: (row.copy() for row in current_docs))
+    assert index.inverted_index() == [{**row, 'tf_idf': approx(row['tf_idf'], 0.001)} for row in expected]
+    index.close()
+
+
+def test_result_cache(tmp_path: tp.Any) -> None:
+    filename = tmp_path / 'docs.txt'
+    docs = [
+        {'doc_id': 1, 'text': 'hello, my little WORLD'},
+        {'doc_id': 2, 'text': 'Hello, my little little hell'}
+    ]
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in docs))
+
+    cache = ResultCache(str(tmp_path / 'cache'))
+    graph = graphs.word_count_graph_from_file(str(filename), json.loads)
+    expected = graph.run()
+    assert graph.run(cache=cache) == expected
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    # result is taken from cache
+    assert graph.run(cache=cache) == expected
+    key = result_cache.fingerprint(graph)
+    assert key is not None
+    assert graphs.word_count_graph_from_file(str(filename), json.loads).run(cache=cache) == expected
+
+    # graph with different parameters is not served from cache
+    other_graph = graphs.word_count_graph_from_file(str(filename), json.loads, count_column='amount')
+    assert result_cache.fingerprint(other_graph) != key
+
+    # changed input is not served from cache
+    docs.append({'doc_id': 3, 'text': 'hello'})
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in docs))
+    assert result_cache.fingerprint(graph) != key
+    assert graph.run(cache=cache) == graph.run()
+
+    # graphs reading iterators are not cached
+    assert result_cache.fingerprint(graphs.word_count_graph('docs')) is None
+
+    # execution of graph sharing operations with cached one starts from the latest cached stage
+    cache = ResultCache(str(tmp_path / 'stages'), cache_stages=True)
+    graph = Graph.graph_from_file(str(filename), json.loads).sort(['doc_id'])
+    assert graph.run(cache=cache) == docs
+    list(cache.store(result_cache.fingerprint(graph), [{'doc_id': 5, 'text': 'stage'}]))  # type: ignore
+    graph = graph.map(ops.Project(['doc_id'])).reduce(ops.FirstReducer(), ['doc_id'])
+    assert graph.run(cache=cache, optimize=False) == [{'doc_id': 5}]
+
+    # stages holding encoded strings are saved with dictionary
+    cache = ResultCache(str(tmp_path / 'word_count_stages'), cache_stages=True)
+    graph = graphs.word_count_graph_from_file(str(filename), json.loads)
+    expected = graph.run(optimize=False)
+    assert graph.run(cache=cache, optimize=False) == expected
+    os.remove(tmp_path / 'word_count_stages' / (result_cache.fingerprint(graph) + '.bin'))  # type: ignore
+    graph = graphs.word_count_graph_from_file(str(filename), json.loads)
+    assert graph.run(cache=cache, optimize=False) == expected
+
+
+def test_checkpoints(tmp_path: tp.Any) -> None:
+    filename = tmp_path / 'docs.txt'
+    docs = [{'doc_id': 2, 'text': 'b'}, {'doc_id': 1, 'text': 'c'}, {'doc_id': 3, 'text': 'a'}]
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in docs))
+    checkpoint_dir = tmp_path / 'checkpoints'
+
+    graph = Graph.graph_from_file(str(filename), json.loads).sort(['doc_id']).sort(['text'])
+    result = graph.run(checkpoint_dir=str(checkpoint_dir), optimize=False, return_lst=False)
+    # the first sort is consumed completely by the second one
+    assert next(iter(result)) == {'doc_id': 3, 'text': 'a'}
+    result.close()  # type: ignore
+    assert len(os.listdir(checkpoint_dir)) == 1
+
+    # restarted run starts from the saved stage
+    key = result_cache.fingerprint(graph, 1)
+    list(ResultCache(str(checkpoint_dir)).store(key, [{'doc_id': 5, 'text': 'stage'}]))  # type: ignore
+    assert graph.run(checkpoint_dir=str(checkpoint_dir), optimize=False) == [{'doc_id': 5, 'text': 'stage'}]
+    assert not os.listdir(checkpoint_dir)
+
+    graph = graphs.inverted_index_graph_from_file(str(filename), json.loads)
+    assert graph.run(checkpoint_dir=str(checkpoint_dir)) == graph.run()
+    assert not os.listdir(checkpoint_dir)
+
+
+def test_inverted_index_term_index_sink(tmp_path: tp.Any) -> None:
+    graph = graphs.inverted_index_graph('texts', doc_column='doc_id', text_column='text', result_column='tf_idf')
+
+    rows = [
+        {'doc_id': 1, 'text': 'hello, little world'},
+        {'doc_id': 2, 'text': 'little'},
+        {'doc_id': 3, 'text': 'little little little'},
+        {'doc_id': 4, 'text': 'little? hello little world'},
+        {'doc_id': 5, 'text': 'HELLO HELLO! WORLD...'},
+        {'doc_id': 6, 'text': 'world? world... world!!! WORLD!!! HELLO!!!'}
+    ]
+    expected = graph.run(texts=lambda: (row.copy() for row in rows))
+
+    filename = str(tmp_path / 'index.bin')
+    assert graph.run(TermIndexSink(filename, block_size=2), texts=lambda: (row.copy() for row in rows)) == 9
+
+    with TermIndex(filename) as index:
+        assert list(index.terms()) == ['hello', 'little', 'world']
+        assert 'little' in index and 'a' not in index and 'zzz' not in index
+        assert index.lookup('unknown') == []
+        for term in index.terms():
+            term_rows = sorted((row for row in expected if row['text'] == term), key=itemgetter('tf_idf'),
+                               reverse=True)
+            assert index.lookup(term) == term_rows
+            assert index.lookup(term, 1) == term_rows[:1]
+
+
 # ########## HEAVY TESTS WITH MEMORY TRACKING ##########
 
 
@@ -269,3 +526,4 @@ def test_yandex_maps_heavy() -> None:
     )
 
     assert expected == sorted(result, key=itemgetter('weekday', 'hour'))
+